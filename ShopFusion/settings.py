@@ -37,6 +37,7 @@ INSTALLED_APPS = [
     'accounts',
     'carts',
     'orders',
+    'outbox',
 ]
 
 MIDDLEWARE = [
@@ -63,6 +64,7 @@ TEMPLATES = [
                 'django.contrib.messages.context_processors.messages',
                 'shop.context_processors.get_categories',
                 'carts.context_processors.counter',
+                'shop.context_processors.page_cache_placeholders',
             ],
         },
     },
@@ -118,10 +120,39 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts and wait for it,
+            # instead of failing with "database is locked" under parallel requests
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        'TEST': {
+            # On disk, so threaded tests share the database like real workers do
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
 
+# Page cache, category list and anonymous carts. Without REDIS_URL every
+# process keeps its own in-memory cache (fine for a single worker); set it
+# to share one Redis between workers. Facet index changes go through the
+# database either way.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -165,6 +196,25 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Storefront listings
+# Keyset (?after=) pagination instead of ?page=N offsets
+SHOP_KEYSET_PAGINATION = True
+# Product count shown on listings: 'exact', 'estimate' (capped at the limit) or 'off'
+SHOP_LISTING_COUNT = 'estimate'
+SHOP_LISTING_COUNT_LIMIT = 1000
+# Full-page cache for anonymous visitors on catalog pages (seconds)
+SHOP_PAGE_CACHE = True
+SHOP_PAGE_CACHE_TIMEOUT = 300
+# Where visitors' carts live until they log in: 'database' (Cart/CartItem rows)
+# or 'cache' (SHOP_ANONYMOUS_CART_CACHE, which must be shared between processes)
+SHOP_ANONYMOUS_CART_STORE = 'database'
+SHOP_ANONYMOUS_CART_CACHE = 'default'
+
+# Editor uploads above these limits are downscaled/re-encoded, decoding is refused above the pixel cap
+TINYMCE_UPLOAD_MAX_DIMENSION = 2048
+TINYMCE_UPLOAD_MAX_BYTES = 2 * 1024 * 1024
+TINYMCE_UPLOAD_MAX_PIXELS = 50_000_000
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -183,10 +233,14 @@ MESSAGE_TAGS = {
 # SMTP Configuration
 
 EMAIL_BACKEND = 'utils.gmail_backend.GmailAPIBackend'
+# Order, registration and password emails are queued in the outbox and delivered
+# by `manage.py run_mail_worker` (try --backend django.core.mail.backends.console.EmailBackend)
 
 GMAIL_CLIENT_ID = os.getenv('GMAIL_CLIENT_ID')
 GMAIL_CLIENT_SECRET = os.getenv('GMAIL_CLIENT_SECRET')
 GMAIL_CLIENT_SECRET_PATH = os.getenv('GMAIL_CLIENT_SECRET_PATH')
+# Dotted path to an httplib2.Http-like class, 'utils.gmail_fake.FakeGmailHttp' sends nothing
+GMAIL_HTTP_TRANSPORT = os.getenv('GMAIL_HTTP_TRANSPORT')
 
 EMAIL_HOST_USER = 'storefrenzy.shop@gmail.com'
 DEFAULT_FROM_EMAIL = 'StoreFrenzy <storefrenzy.shop@gmail.com>'
@@ -2,16 +2,23 @@ from django.http import JsonResponse
 from django.core.files.storage import default_storage
 from django.views.decorators.csrf import csrf_exempt
 
+from utils.uploads import HashingFileUploadHandler, ImageTooLarge, store_upload
+
 @csrf_exempt
 def tinymce_upload(request):
     if request.method != 'POST':
         return JsonResponse({'error': 'Invalid request'}, status=400)
     
+    # Hash the upload while it streams to disk, before request.FILES is parsed
+    request.upload_handlers = [HashingFileUploadHandler(request)]
     file = request.FILES.get('file')
     if not file:
         return JsonResponse({'error': 'No file provided'}, status=400)
     
-    filename = default_storage.save(f'tinymce/{file.name}', file)
+    try:
+        filename = store_upload(file, 'tinymce')
+    except ImageTooLarge:
+        return JsonResponse({'error': 'Image is too large'}, status=400)
     file_url = default_storage.url(filename)
     
-    return JsonResponse({'location': file_url})
\ No newline at end of file
+    return JsonResponse({'location': file_url})
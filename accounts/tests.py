@@ -1,3 +1,64 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.urls import reverse
 
-# Create your tests here.
+from accounts.models import Account
+from carts.models import Cart, CartItem
+from shop.models import Product, Variation
+
+
+class LoginCartMergeTests(TestCase):
+    def setUp(self):
+        self.shirt = Product.objects.create(product_name='Shirt', slug='shirt', price=10, stock=100)
+        self.socks = Product.objects.create(product_name='Socks', slug='socks', price=2, stock=100)
+        self.cap = Product.objects.create(product_name='Cap', slug='cap', price=5, stock=100)
+        self.red = Variation.objects.create(product=self.cap, variation_category='color', variation_value='Red')
+        self.user = Account.objects.create_user(
+            first_name='Ada', last_name='Lovelace', username='ada', email='ada@example.com', password='secret'
+        )
+        Account.objects.filter(pk=self.user.pk).update(is_active=True)
+        # The user already has two shirts from an earlier visit
+        CartItem.objects.create(user=self.user, product=self.shirt, quantity=2)
+
+    def add(self, product, quantity=1, **variations):
+        for _ in range(quantity):
+            self.client.post(reverse('add_cart', args=[product.id]), variations)
+
+    def fill_anonymous_cart(self):
+        self.add(self.shirt)
+        self.add(self.socks, 3)
+        self.add(self.cap, 2, color='red')
+
+    def log_in(self):
+        self.client.post(reverse('login'), {'email': 'ada@example.com', 'password': 'secret'})
+
+    def assertMerged(self):
+        lines = {
+            (item.product.slug, tuple(item.variations.values_list('pk', flat=True))): item.quantity
+            for item in CartItem.objects.filter(user=self.user)
+        }
+        self.assertEqual(lines, {
+            ('shirt', ()): 3,
+            ('socks', ()): 3,
+            ('cap', (self.red.pk,)): 2,
+        })
+        # Plain lines of different products stay separate lines
+        self.assertEqual(CartItem.objects.filter(user=self.user, variation_key='').count(), 2)
+        self.assertFalse(CartItem.objects.filter(user__isnull=True).exists())
+
+    def test_session_cart_is_merged_into_the_user_cart(self):
+        self.fill_anonymous_cart()
+        self.assertEqual(CartItem.objects.filter(cart__isnull=False).count(), 3)
+        self.log_in()
+        self.assertMerged()
+        self.assertFalse(Cart.objects.exists())
+
+    @override_settings(SHOP_ANONYMOUS_CART_STORE='cache')
+    def test_cache_cart_is_merged_into_the_user_cart(self):
+        self.fill_anonymous_cart()
+        self.assertFalse(Cart.objects.exists())
+        self.log_in()
+        self.assertMerged()
+        # Logging in again adds nothing, the cache cart was emptied
+        self.client.logout()
+        self.log_in()
+        self.assertMerged()
@@ -11,9 +11,13 @@ from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes
 from django.contrib.auth.tokens import default_token_generator
 from django.core.mail import EmailMessage
+from outbox.mail import queue_email
 
+from carts.anonymous import get_anonymous_cart, is_enabled as anonymous_carts_enabled
 from carts.models import Cart, CartItem
 from carts.views import _cart_id
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
 import requests
 
 from orders.models import Order
@@ -32,22 +36,24 @@ def register(request):
             username = email.split("@")[0]
 
             try:
-                user = Account.objects.create_user(first_name=first_name, last_name=last_name, email=email, username=username, password=password)
-                user.phone_number = phone_number
-                user.save()
-
-                # User Activation
-                current_site = get_current_site(request)
-                mail_subject = "Please activate your account"
-                message = render_to_string('accounts/emails/account_verification_email.html', {
-                    'user': user,
-                    'domain': current_site,
-                    'uid': urlsafe_base64_encode(force_bytes(user.pk)),
-                    'token': default_token_generator.make_token(user),
-                })
-                to_email = email
-                send_email = EmailMessage(mail_subject, message, to=[to_email])
-                send_email.send()
+                # The account and its activation email are committed together
+                with transaction.atomic():
+                    user = Account.objects.create_user(first_name=first_name, last_name=last_name, email=email, username=username, password=password)
+                    user.phone_number = phone_number
+                    user.save()
+
+                    # User Activation
+                    current_site = get_current_site(request)
+                    mail_subject = "Please activate your account"
+                    message = render_to_string('accounts/emails/account_verification_email.html', {
+                        'user': user,
+                        'domain': current_site,
+                        'uid': urlsafe_base64_encode(force_bytes(user.pk)),
+                        'token': default_token_generator.make_token(user),
+                    })
+                    to_email = email
+                    send_email = EmailMessage(mail_subject, message, to=[to_email])
+                    queue_email(send_email)
 
                 # messages.success(request, 'Registration successful! Check your email for verification link.')
                 return redirect('/auth/login/?command=verification&email='+email)
@@ -102,52 +108,75 @@ def login(request):
 def _merge_session_cart_with_user_cart(request, user):
     """
     Merges anonymous session cart items with authenticated user's cart.
-    If same product+variations exist, increases quantity. Otherwise, transfers item.
+    Lines are matched on (product, variation_key): a line the user already has
+    gets the session quantity added, any other line is transferred.
+    Both carts are read in one query each and written with a fixed number of
+    bulk statements, however many lines they hold.
     """
-    try:
-        # Get anonymous session cart
-        cart = Cart.objects.get(cart_id=_cart_id(request))
-        cart_item = CartItem.objects.filter(cart=cart)
-        
-        if not cart_item.exists():
-            return
-        
-        # Get user's existing cart items
-        user_cart_items = CartItem.objects.filter(user=user)
-        
-        # Build lookup dict: variation_ids (sorted tuple) -> user cart item
-        user_variation_map = {}
-        for item in user_cart_items:
-            variation_ids = tuple(sorted(item.variations.values_list('id', flat=True)))
-            user_variation_map[variation_ids] = item
-        
-        # Process each session cart item
-        for item in cart_item:
-            # Get variation IDs for current item
-            variation_ids = tuple(sorted(item.variations.values_list('id', flat=True)))
-            
-            # Check if user already has this product+variation combo
-            if variation_ids in user_variation_map:
-                # Increase quantity of existing user cart item
-                existing_item = user_variation_map[variation_ids]
-                existing_item.quantity += item.quantity
-                existing_item.save()
-                
-                # Delete session cart item (merged)
-                item.delete()
+    cart_id = _cart_id(request, create=False)
+    if not cart_id:
+        return
+
+    # Lines kept in the cache (SHOP_ANONYMOUS_CART_STORE = 'cache')
+    anonymous_cart = get_anonymous_cart(request) if anonymous_carts_enabled() else None
+    cached_items = anonymous_cart.items() if anonymous_cart else []
+
+    with transaction.atomic():
+        user_lines = {
+            (product_id, variation_key): pk
+            for pk, product_id, variation_key in CartItem.objects.filter(user=user).values_list(
+                'pk', 'product_id', 'variation_key'
+            )
+        }
+        session_lines = CartItem.objects.filter(cart__cart_id=cart_id).values_list(
+            'pk', 'product_id', 'variation_key', 'quantity'
+        )
+
+        increments = {}
+        transferred = []
+        merged = []
+        for pk, product_id, variation_key, quantity in session_lines:
+            line = (product_id, variation_key)
+            if line in user_lines:
+                user_pk = user_lines[line]
+                increments[user_pk] = increments.get(user_pk, 0) + quantity
+                merged.append(pk)
             else:
-                # Transfer session cart item to user
-                item.user = user
-                item.cart = None  # Disconnect from session cart
-                item.save()
-        
-        # Optional: Delete empty session cart
-        if not CartItem.objects.filter(cart=cart).exists():
-            cart.delete()
-            
-    except Cart.DoesNotExist:
-        # No session cart exists, nothing to merge
-        pass
+                user_lines[line] = pk
+                transferred.append(pk)
+
+        new_items = []
+        for item in cached_items:
+            line = (item.product.pk, item.variation_key)
+            if line in user_lines:
+                user_pk = user_lines[line]
+                increments[user_pk] = increments.get(user_pk, 0) + item.quantity
+            else:
+                new_items.append(item)
+
+        if increments:
+            CartItem.objects.filter(pk__in=increments).update(quantity=F('quantity') + Case(
+                *[When(pk=pk, then=Value(quantity)) for pk, quantity in increments.items()],
+                output_field=IntegerField(),
+            ))
+        if transferred:
+            CartItem.objects.filter(pk__in=transferred).update(user=user, cart=None)
+        if merged:
+            CartItem.objects.filter(pk__in=merged).delete()
+        if new_items:
+            created = CartItem.objects.bulk_create(
+                CartItem(user=user, product=item.product, variation_key=item.variation_key, quantity=item.quantity)
+                for item in new_items
+            )
+            CartItem.variations.through.objects.bulk_create(
+                CartItem.variations.through(cartitem_id=cart_item.pk, variation_id=variation.pk)
+                for cart_item, item in zip(created, new_items)
+                for variation in item.variations
+            )
+        Cart.objects.filter(cart_id=cart_id).delete()
+
+    if anonymous_cart:
+        anonymous_cart.clear()
 
 
 @login_required(login_url = 'login')
@@ -273,7 +302,7 @@ def forgot_password(request):
             })
             to_email = email
             send_email = EmailMessage(mail_subject, message, to=[to_email])
-            send_email.send()
+            queue_email(send_email)
 
             messages.success(request, "Check email address for password reset link")
             return redirect('login')
@@ -0,0 +1,149 @@
+"""
+Cache-backed carts for anonymous visitors.
+
+With SHOP_ANONYMOUS_CART_STORE = 'cache' a visitor's cart lines live in the
+SHOP_ANONYMOUS_CART_CACHE cache under their session key instead of Cart and
+CartItem rows. They reach the database only when the visitor logs in and
+accounts.views._merge_session_cart_with_user_cart moves them to the user's
+cart. In multi-process deployments the cache has to be shared (file, Redis,
+memcached); the local-memory cache only works with a single process.
+"""
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+from carts.models import variation_signature
+from shop.models import Product, Variation
+
+CART_KEY = 'carts:anonymous:%s'
+LOCK_KEY = 'carts:anonymous-lock:%s'
+LOCK_TIMEOUT = 5
+LOCK_WAIT = 0.01
+
+
+def is_enabled():
+    return getattr(settings, 'SHOP_ANONYMOUS_CART_STORE', 'database') == 'cache'
+
+
+def _cache():
+    return caches[getattr(settings, 'SHOP_ANONYMOUS_CART_CACHE', 'default')]
+
+
+class _Variations(list):
+    """Lets templates call item.variations.all like on a CartItem."""
+
+    def all(self):
+        return self
+
+
+class CachedCartItem:
+    """A cached cart line with the CartItem attributes the cart templates use."""
+
+    def __init__(self, line, product, variations):
+        self.id = line['id']
+        self.product = product
+        self.quantity = line['quantity']
+        self.variations = _Variations(variations)
+        self.variation_key = variation_signature(variation.pk for variation in variations)
+
+    def sub_total(self):
+        return self.product.price * self.quantity
+
+
+class CacheCart:
+    """
+    Lines are stored as {'next_id': n, 'lines': [{id, product_id, variation_ids, quantity}]}.
+    Writes hold a short per-cart lock so parallel tabs don't lose updates.
+    """
+
+    def __init__(self, session_key):
+        self.key = CART_KEY % session_key
+        self.lock_key = LOCK_KEY % session_key
+
+    def _load(self):
+        return _cache().get(self.key) or {'next_id': 1, 'lines': []}
+
+    @contextmanager
+    def _change(self):
+        cache = _cache()
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while not cache.add(self.lock_key, 1, LOCK_TIMEOUT) and time.monotonic() < deadline:
+            time.sleep(LOCK_WAIT)
+        try:
+            data = self._load()
+            yield data
+            if data['lines']:
+                cache.set(self.key, data, settings.SESSION_COOKIE_AGE)
+            else:
+                cache.delete(self.key)
+        finally:
+            cache.delete(self.lock_key)
+
+    def lines(self):
+        return self._load()['lines']
+
+    def add(self, product_id, variation_ids, quantity=1):
+        variation_ids = sorted(set(variation_ids))
+        with self._change() as data:
+            for line in data['lines']:
+                if line['product_id'] == product_id and line['variation_ids'] == variation_ids:
+                    line['quantity'] += quantity
+                    return
+            data['lines'].append({
+                'id': data['next_id'],
+                'product_id': product_id,
+                'variation_ids': variation_ids,
+                'quantity': quantity,
+            })
+            data['next_id'] += 1
+
+    def remove(self, product_id, line_id):
+        """Takes one unit off a line, the last unit removes it."""
+        with self._change() as data:
+            for line in data['lines']:
+                if line['id'] == line_id and line['product_id'] == product_id:
+                    line['quantity'] -= 1
+            data['lines'] = [line for line in data['lines'] if line['quantity'] > 0]
+
+    def delete(self, product_id, line_id):
+        with self._change() as data:
+            data['lines'] = [
+                line for line in data['lines']
+                if not (line['id'] == line_id and line['product_id'] == product_id)
+            ]
+
+    def clear(self):
+        _cache().delete(self.key)
+
+    def count(self):
+        return sum(line['quantity'] for line in self.lines())
+
+    def items(self):
+        """The lines as CachedCartItem objects, in two queries."""
+        lines = self.lines()
+        products = Product.objects.in_bulk({line['product_id'] for line in lines})
+        variations = Variation.objects.in_bulk({pk for line in lines for pk in line['variation_ids']})
+        return [
+            CachedCartItem(
+                line,
+                products[line['product_id']],
+                [variations[pk] for pk in line['variation_ids'] if pk in variations],
+            )
+            for line in lines if line['product_id'] in products
+        ]
+
+
+def uses_cache_cart(request):
+    """Whether this request's cart lives in the cache rather than the database."""
+    return is_enabled() and not request.user.is_authenticated
+
+
+def get_anonymous_cart(request, create=False):
+    """The visitor's CacheCart, None when they have no session yet."""
+    session_key = request.session.session_key
+    if not session_key and create:
+        request.session.create()
+        session_key = request.session.session_key
+    return CacheCart(session_key) if session_key else None
@@ -1,22 +1,27 @@
-from carts.views import _cart_id
-from .models import Cart, CartItem
+from django.db.models import Sum
 
-def counter(request):
-    cart_count = 0
-    if 'admin' in request.path:
-        return()
+from .anonymous import get_anonymous_cart, uses_cache_cart
+from .models import CartItem
+
+def cart_count(request):
+    """Units in the requester's cart, never creates a session."""
+    # to store cart item once user is logged in
+    if request.user.is_authenticated:
+        cart_items = CartItem.objects.filter(user=request.user)
     else:
-        try:
-            cart = Cart.objects.filter(cart_id=_cart_id(request))
-            # to store cart item once user is logged in
-            if request.user.is_authenticated:
-                cart_items = CartItem.objects.all().filter(user=request.user)
-            
-            else:
-            # to store cart item once user is logged in
-                cart_items = CartItem.objects.all().filter(cart=cart[:1])
-            for cart_item in cart_items:
-                cart_count += cart_item.quantity
-        except Cart.DoesNotExist:
-            cart_count = 0
-    return dict(cart_count=cart_count)
\ No newline at end of file
+        # Only visitors who already have a session can have a cart,
+        # never create one here (crawlers hit every page)
+        session_key = request.session.session_key
+        if not session_key:
+            return 0
+        if uses_cache_cart(request):
+            return get_anonymous_cart(request).count()
+        cart_items = CartItem.objects.filter(cart__cart_id=session_key)
+    return cart_items.aggregate(total=Sum('quantity'))['total'] or 0
+
+
+def counter(request):
+    # The admin has no cart badge
+    if request.path.startswith('/admin/'):
+        return dict(cart_count=0)
+    return dict(cart_count=cart_count(request))
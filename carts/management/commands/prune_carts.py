@@ -0,0 +1,90 @@
+import time
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from carts.models import Cart, CartItem
+
+# Session engines whose sessions are rows in django_session
+DATABASE_SESSION_ENGINES = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+)
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions, abandoned anonymous carts and orphaned cart items in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Rows deleted per statement, keeps each write lock short')
+        parser.add_argument('--time-limit', type=float, default=60,
+                            help='Stop starting new batches after this many seconds')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to sleep between batches to let other writers in')
+        parser.add_argument('--max-age-days', type=int, default=None,
+                            help='Also delete anonymous carts created more than this many days ago')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        self.batch_size = options['batch_size']
+        self.pause = options['pause']
+        self.deadline = time.monotonic() + options['time_limit']
+        self.out_of_time = False
+        started = time.monotonic()
+        now = timezone.now()
+
+        sessions_in_db = settings.SESSION_ENGINE in DATABASE_SESSION_ENGINES
+        if sessions_in_db:
+            sessions = self.prune('sessions', Session.objects.filter(expire_date__lt=now), 'session_key')
+        else:
+            import_module(settings.SESSION_ENGINE).SessionStore.clear_expired()
+            sessions = 0
+
+        # Anonymous carts are keyed by session key, once the session is gone nobody can reach them.
+        # Without database sessions there is nothing to check against, fall back to the cookie age.
+        if sessions_in_db:
+            live_sessions = Session.objects.filter(expire_date__gte=now).values('session_key')
+            abandoned = Cart.objects.exclude(cart_id__in=live_sessions)
+        else:
+            created_before = now - timedelta(seconds=settings.SESSION_COOKIE_AGE)
+            abandoned = Cart.objects.filter(date_added__lt=created_before.date())
+        carts = self.prune('carts', abandoned)
+        if options['max_age_days'] is not None:
+            created_before = now - timedelta(days=options['max_age_days'])
+            carts += self.prune('old carts', Cart.objects.filter(date_added__lt=created_before.date()))
+
+        # Lines that belong to neither a user nor a cart
+        items = self.prune('orphaned cart items', CartItem.objects.filter(user__isnull=True, cart__isnull=True))
+
+        elapsed = time.monotonic() - started
+        summary = (
+            f"Deleted {sessions} expired sessions, {carts} abandoned carts and "
+            f"{items} orphaned cart items in {elapsed:.1f}s."
+        )
+        if self.out_of_time:
+            self.stdout.write(self.style.WARNING(f"{summary} Time limit reached, run again to continue."))
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
+
+    def prune(self, label, queryset, pk_name='pk'):
+        """Deletes the queryset's rows batch by batch, returns how many rows of the model went."""
+        model = queryset.model
+        deleted = 0
+        while not self.out_of_time:
+            pks = list(queryset.order_by(pk_name).values_list(pk_name, flat=True)[:self.batch_size])
+            if not pks:
+                break
+            _, per_model = model._default_manager.filter(**{f'{pk_name}__in': pks}).delete()
+            deleted += per_model.get(model._meta.label, 0)
+            if self.verbosity >= 2:
+                self.stdout.write(f"{label}: {deleted} deleted")
+            if time.monotonic() >= self.deadline:
+                self.out_of_time = True
+            elif self.pause:
+                time.sleep(self.pause)
+        return deleted
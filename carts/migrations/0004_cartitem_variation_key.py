@@ -0,0 +1,57 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_variation_keys(apps, schema_editor):
+    """Fills variation_key and folds lines that turn out to be duplicates into one."""
+    CartItem = apps.get_model('carts', 'CartItem')
+    Through = CartItem.variations.through
+
+    variation_ids = {}
+    for cart_item_id, variation_id in Through.objects.values_list('cartitem_id', 'variation_id').iterator():
+        variation_ids.setdefault(cart_item_id, []).append(variation_id)
+
+    lines = {}
+    duplicates = []
+    items = []
+    for item in CartItem.objects.order_by('pk').iterator():
+        item.variation_key = ','.join(str(pk) for pk in sorted(set(variation_ids.get(item.pk, ()))))
+        # Same owner as the unique constraints: the user if set, else the session cart
+        owner = ('user', item.user_id) if item.user_id else ('cart', item.cart_id)
+        line = (owner, item.product_id, item.variation_key)
+        if owner[1] is not None and line in lines:
+            lines[line].quantity += item.quantity
+            duplicates.append(item.pk)
+        else:
+            lines[line] = item
+            items.append(item)
+    CartItem.objects.filter(pk__in=duplicates).delete()
+    CartItem.objects.bulk_update(items, ['variation_key', 'quantity'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0003_cartitem_user_alter_cartitem_cart'),
+        ('shop', '0018_variation_lookup_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='variation_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_variation_keys, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', False)), fields=('user', 'product', 'variation_key'), name='cartitem_user_line_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(condition=models.Q(('cart__isnull', False)), fields=('cart', 'product', 'variation_key'), name='cartitem_cart_line_unique'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:46
+
+from django.db import migrations
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    """Folds carts sharing a cart_id into the oldest one, adding up lines that collide."""
+    Cart = apps.get_model('carts', 'Cart')
+    CartItem = apps.get_model('carts', 'CartItem')
+
+    cart_pks = {}
+    for pk, cart_id in Cart.objects.order_by('pk').values_list('pk', 'cart_id').iterator():
+        cart_pks.setdefault(cart_id, []).append(pk)
+
+    for keeper, *duplicates in cart_pks.values():
+        if not duplicates:
+            continue
+        lines = {
+            (item.product_id, item.variation_key): item
+            for item in CartItem.objects.filter(cart_id=keeper)
+        }
+        moved = []
+        merged = []
+        for item in CartItem.objects.filter(cart_id__in=duplicates).order_by('pk'):
+            line = lines.get((item.product_id, item.variation_key))
+            if line is None:
+                item.cart_id = keeper
+                lines[(item.product_id, item.variation_key)] = item
+                moved.append(item)
+            else:
+                line.quantity += item.quantity
+                merged.append(line)
+        CartItem.objects.bulk_update(moved, ['cart'])
+        CartItem.objects.bulk_update(set(merged), ['quantity'])
+        # Lines that were added to another one go with their cart
+        Cart.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0005_cart_prune_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_carts, migrations.RunPython.noop),
+    ]
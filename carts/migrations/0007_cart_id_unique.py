@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0006_merge_duplicate_carts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cart',
+            name='cart_id',
+            field=models.CharField(blank=True, max_length=250, unique=True),
+        ),
+    ]
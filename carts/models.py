@@ -1,11 +1,19 @@
 from django.db import models
+from django.db.models import Q
 
 from accounts.models import Account
 from shop.models import Product, Variation
 
+
+def variation_signature(variation_ids):
+    """Canonical key of a variation combination: sorted ids joined by commas, '' for none."""
+    return ','.join(str(pk) for pk in sorted(set(variation_ids)))
+
+
 class Cart(models.Model):
-    cart_id = models.CharField(max_length=250, blank=True)
-    date_added = models.DateField(auto_now_add=True)
+    # The session key, one cart per session
+    cart_id = models.CharField(max_length=250, blank=True, unique=True)
+    date_added = models.DateField(auto_now_add=True, db_index=True)
 
     def __str__(self):
         return self.cart_id
@@ -14,10 +22,26 @@ class CartItem(models.Model):
     user = models.ForeignKey(Account, on_delete=models.CASCADE, null=True)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     variations = models.ManyToManyField(Variation, blank=True)
+    # variation_signature() of the variations, one cart line per product and combination
+    variation_key = models.CharField(max_length=255, blank=True, default='', editable=False)
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, null=True)
     quantity = models.IntegerField()
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'product', 'variation_key'],
+                condition=Q(user__isnull=False),
+                name='cartitem_user_line_unique',
+            ),
+            models.UniqueConstraint(
+                fields=['cart', 'product', 'variation_key'],
+                condition=Q(cart__isnull=False),
+                name='cartitem_cart_line_unique',
+            ),
+        ]
+
     def sub_total(self):
         return self.product.price * self.quantity
 
@@ -0,0 +1,49 @@
+"""
+Cart contents and totals for the cart, checkout and place-order pages.
+
+Items are loaded with their product (select_related) and variations
+(prefetch_related) and totalled in one pass, so a cart page costs the same
+few queries however many lines the cart has.
+"""
+from carts.models import CartItem
+
+# Tax added to the cart total, in percent
+TAX_RATE = 1.5
+
+
+def cart_items(**owner):
+    """The active lines of a cart, owner is user=... or cart__cart_id=..."""
+    return (
+        CartItem.objects.filter(is_active=True, **owner)
+        .select_related('product')
+        .prefetch_related('variations')
+        .order_by('id')
+    )
+
+
+class CartSummary:
+    def __init__(self, items=()):
+        self.items = list(items)
+        self.total = 0
+        self.quantity = 0
+        for item in self.items:
+            self.total += item.product.price * item.quantity
+            self.quantity += item.quantity
+        self.tax = (TAX_RATE * self.total) / 100
+        self.grand_total = self.total + self.tax
+
+    def __len__(self):
+        return len(self.items)
+
+    def context(self):
+        return {
+            'cart_items': self.items,
+            'total': self.total,
+            'quantity': self.quantity,
+            'tax': self.tax,
+            'grand_total': self.grand_total,
+        }
+
+
+def get_cart_summary(**owner):
+    return CartSummary(cart_items(**owner))
@@ -1,3 +1,142 @@
-from django.test import TestCase
+import threading
 
-# Create your tests here.
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import Client, TestCase, TransactionTestCase
+from django.urls import reverse
+
+from accounts.models import Account
+from carts.models import Cart, CartItem
+from shop.models import Product, Variation
+from utils.testing import use_temporary_media
+
+
+class ConcurrentCartTests(TransactionTestCase):
+    """Many threads hammering one cart line must not lose or invent units."""
+
+    threads = 8
+    clicks = 15
+
+    def setUp(self):
+        use_temporary_media(self, 'shirt.jpg')
+        self.product = Product.objects.create(
+            product_name='Shirt', slug='shirt', price=10, stock=100, product_image='shirt.jpg'
+        )
+        Variation.objects.create(product=self.product, variation_category='color', variation_value='Red')
+        self.user = Account.objects.create_user(
+            first_name='Ada', last_name='Lovelace', username='ada', email='ada@example.com', password='secret'
+        )
+        Account.objects.filter(pk=self.user.pk).update(is_active=True)
+
+    def hammer(self, post_url, data=None, clients=None):
+        if clients is None:
+            clients = []
+            for _ in range(self.threads):
+                client = Client()
+                client.force_login(self.user)
+                clients.append(client)
+        errors = []
+
+        def click(client):
+            try:
+                for _ in range(self.clicks):
+                    client.post(post_url(), data or {})
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=click, args=(client,)) for client in clients]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+
+    def line(self):
+        return CartItem.objects.get(user=self.user, product=self.product)
+
+    def test_parallel_adds_and_removes_keep_exact_quantity(self):
+        add_url = reverse('add_cart', args=[self.product.id])
+        self.hammer(lambda: add_url, {'color': 'red'})
+
+        # One line for the combination, with every click counted
+        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 1)
+        line = self.line()
+        self.assertEqual(line.quantity, self.threads * self.clicks)
+        self.assertEqual(line.variation_key, str(Variation.objects.get().pk))
+
+        remove_url = reverse('remove_cart', args=[self.product.id, line.id])
+        self.clicks -= 5
+        self.hammer(lambda: remove_url)
+        self.assertEqual(self.line().quantity, self.threads * 5)
+
+        # More removes than units left: the line goes away, never below one
+        self.clicks = 10
+        self.hammer(lambda: remove_url)
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
+
+    def test_parallel_first_adds_share_one_session_cart(self):
+        session = Client().session
+        session.save()
+        clients = []
+        for _ in range(self.threads):
+            client = Client()
+            client.cookies['sessionid'] = session.session_key
+            clients.append(client)
+        self.clicks = 3
+        self.hammer(lambda: reverse('add_cart', args=[self.product.id]), {'color': 'red'}, clients)
+
+        cart = Cart.objects.get(cart_id=session.session_key)
+        self.assertEqual(CartItem.objects.get(cart=cart).quantity, self.threads * self.clicks)
+
+
+class AddToCartTests(TestCase):
+    def test_variation_keys_match_whatever_their_case(self):
+        product = Product.objects.create(product_name='Cap', slug='cap', price=5, stock=10)
+        red = Variation.objects.create(product=product, variation_category='color', variation_value='Red')
+        large = Variation.objects.create(product=product, variation_category='size', variation_value='L')
+        self.client.post(reverse('add_cart', args=[product.id]), {'Color': 'red', 'SIZE': 'l'})
+
+        line = CartItem.objects.get()
+        self.assertEqual(sorted(line.variations.all(), key=lambda v: v.pk), [red, large])
+        self.assertEqual(line.variation_key, f'{red.pk},{large.pk}')
+
+
+class MergeDuplicateCartsMigrationTests(TransactionTestCase):
+    before = [('carts', '0005_cart_prune_indexes')]
+    after = [('carts', '0007_cart_id_unique')]
+
+    def migrate(self, targets=None):
+        executor = MigrationExecutor(connection)
+        targets = targets or executor.loader.graph.leaf_nodes()
+        executor.migrate(targets)
+        executor.loader.build_graph()
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate()
+
+    def test_duplicate_carts_are_merged_into_the_oldest(self):
+        apps = self.migrate(self.before)
+        Cart = apps.get_model('carts', 'Cart')
+        CartItem = apps.get_model('carts', 'CartItem')
+        Product = apps.get_model('shop', 'Product')
+        shirt = Product.objects.create(product_name='Shirt', slug='shirt', price=10, stock=100)
+        socks = Product.objects.create(product_name='Socks', slug='socks', price=5, stock=100)
+        first = Cart.objects.create(cart_id='abc')
+        second = Cart.objects.create(cart_id='abc')
+        other = Cart.objects.create(cart_id='xyz')
+        CartItem.objects.create(cart=first, product=shirt, quantity=1)
+        CartItem.objects.create(cart=second, product=shirt, quantity=2)
+        CartItem.objects.create(cart=second, product=socks, quantity=4)
+        CartItem.objects.create(cart=other, product=shirt, quantity=7)
+
+        apps = self.migrate(self.after)
+        Cart = apps.get_model('carts', 'Cart')
+        CartItem = apps.get_model('carts', 'CartItem')
+        self.assertEqual(list(Cart.objects.order_by('pk').values_list('pk', flat=True)), [first.pk, other.pk])
+        self.assertEqual(
+            sorted(CartItem.objects.values_list('cart_id', 'product__slug', 'quantity')),
+            sorted([(first.pk, 'shirt', 3), (first.pk, 'socks', 4), (other.pk, 'shirt', 7)]),
+        )
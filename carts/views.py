@@ -1,13 +1,21 @@
 from django.shortcuts import get_object_or_404, redirect, render
-from carts.models import Cart, CartItem
+from carts.anonymous import get_anonymous_cart, uses_cache_cart
+from carts.models import Cart, CartItem, variation_signature
+from carts.summary import CartSummary, get_cart_summary
 from shop.models import Product, Variation
 from django.contrib.auth.decorators import login_required
-from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError, transaction
+from django.db.models import F
 
-def _cart_id(request):
+def _cart_id(request, create=True):
+    """
+    Session key used as the anonymous cart id.
+    Read-only callers pass create=False so browsing never writes a session row.
+    """
     cart = request.session.session_key
-    if not cart:
-        cart = request.session.create()
+    if not cart and create:
+        request.session.create()
+        cart = request.session.session_key
     return cart
 
 
@@ -25,6 +33,8 @@ def add_cart(request, product_id):
     # Route based on authentication
     if current_user.is_authenticated:
         _add_to_user_cart(product, product_variation, current_user)
+    elif uses_cache_cart(request):
+        get_anonymous_cart(request, create=True).add(product.id, [v.id for v in product_variation])
     else:
         _add_to_session_cart(request, product, product_variation)
     
@@ -39,62 +49,56 @@ def _extract_product_variations(request, product):
     product_variation = []
     
     if request.method == 'POST':
-        for item in request.POST:
-            key = item
-            value = request.POST[key]
-            
-            try:
-                variation = Variation.objects.get(
-                    product=product,
-                    variation_category__iexact=key,
-                    variation_value__iexact=value
-                )
+        # All of the product's active variations in one query, matched case-insensitively
+        variations = {}
+        for variation in Variation.objects.filter(product=product, is_active=True):
+            key = (variation.variation_category.lower(), variation.variation_value.strip().lower())
+            variations.setdefault(key, variation)
+        
+        # Forms may post 'Color' or 'color', keys match case-insensitively like the values
+        posted = {key.lower(): value for key, value in request.POST.items()}
+        # Only the product's variation categories are looked up, whatever else is posted
+        for category in {category for category, _ in variations}:
+            value = posted.get(category)
+            variation = variations.get((category, value.strip().lower())) if value else None
+            if variation is not None:
                 product_variation.append(variation)
-            except Variation.DoesNotExist:
-                pass
     
     return product_variation
 
 
+def _add_cart_line(product, product_variation, quantity=1, **owner):
+    """
+    Adds quantity units of product with these variations to the owner's cart
+    (user=... or cart=...). The line is found through the unique
+    (owner, product, variation_key) index and bumped in place, or created.
+    """
+    variation_key = variation_signature(variation.id for variation in product_variation)
+    line = CartItem.objects.filter(product=product, variation_key=variation_key, **owner)
+    with transaction.atomic():
+        if line.update(quantity=F('quantity') + quantity):
+            return
+        try:
+            with transaction.atomic():
+                cart_item = CartItem.objects.create(
+                    product=product,
+                    variation_key=variation_key,
+                    quantity=quantity,
+                    **owner
+                )
+                if product_variation:
+                    cart_item.variations.set(product_variation)
+        except IntegrityError:
+            # A parallel request created the same line first
+            line.update(quantity=F('quantity') + quantity)
+
+
 def _add_to_user_cart(product, product_variation, current_user):
     """
     Creates separate CartItem for each unique variation combination.
     Increases quantity if same combo already exists.
     """
-    # Get variation IDs for comparison
-    product_variation_ids = sorted([v.id for v in product_variation])
-    
-    # Check existing cart items for this product
-    cart_items = CartItem.objects.filter(product=product, user=current_user)
-    
-    if cart_items.exists():
-        # Find if exact variation combo exists
-        for cart_item in cart_items:
-            existing_variation_ids = sorted(list(cart_item.variations.values_list('id', flat=True)))
-            
-            if product_variation_ids == existing_variation_ids:
-                # Same combo found - increase quantity
-                cart_item.quantity += 1
-                cart_item.save()
-                return
-        
-        # Different combo - create new cart item
-        cart_item = CartItem.objects.create(
-            product=product,
-            quantity=1,
-            user=current_user
-        )
-        if product_variation:
-            cart_item.variations.set(product_variation)
-    else:
-        # First cart item for this product
-        cart_item = CartItem.objects.create(
-            product=product,
-            quantity=1,
-            user=current_user
-        )
-        if product_variation:
-            cart_item.variations.set(product_variation)
+    _add_cart_line(product, product_variation, user=current_user)
 
 
 def _add_to_session_cart(request, product, product_variation):
@@ -102,136 +106,66 @@ def _add_to_session_cart(request, product, product_variation):
     Creates separate CartItem for each unique variation combination.
     Increases quantity if same combo already exists.
     """
-    # Get or create session cart
-    try:
-        cart = Cart.objects.get(cart_id=_cart_id(request))
-    except Cart.DoesNotExist:
-        cart = Cart.objects.create(cart_id=_cart_id(request))
-    
-    # Get variation IDs for comparison
-    product_variation_ids = sorted([v.id for v in product_variation])
-    
-    # Check existing cart items for this product
-    cart_items = CartItem.objects.filter(product=product, cart=cart)
-    
-    if cart_items.exists():
-        # Find if exact variation combo exists
-        for cart_item in cart_items:
-            existing_variation_ids = sorted(list(cart_item.variations.values_list('id', flat=True)))
-            
-            if product_variation_ids == existing_variation_ids:
-                # Same combo found - increase quantity
-                cart_item.quantity += 1
-                cart_item.save()
-                return
-        
-        # Different combo - create new cart item
-        cart_item = CartItem.objects.create(
-            product=product,
-            quantity=1,
-            cart=cart
-        )
-        if product_variation:
-            cart_item.variations.set(product_variation)
-    else:
-        # First cart item for this product
-        cart_item = CartItem.objects.create(
-            product=product,
-            quantity=1,
-            cart=cart
-        )
-        if product_variation:
-            cart_item.variations.set(product_variation)
+    # cart_id is unique, so parallel first adds end up in the same cart
+    cart, _ = Cart.objects.get_or_create(cart_id=_cart_id(request))
+
+    _add_cart_line(product, product_variation, cart=cart)
+
+def _owned_cart_item(request, product, cart_item_id):
+    """The requester's cart line as a queryset, empty when it isn't theirs or there is no cart."""
+    cart_item = CartItem.objects.filter(id=cart_item_id, product=product)
+    if request.user.is_authenticated:
+        return cart_item.filter(user=request.user)
+    cart_id = _cart_id(request, create=False)
+    if not cart_id:
+        return CartItem.objects.none()
+    return cart_item.filter(cart__cart_id=cart_id)
+
 
 def remove_cart(request, product_id, cart_item_id):
     product = get_object_or_404(Product, id=product_id)
-    try:
-        if request.user.is_authenticated:
-            cart_item = CartItem.objects.get(id=cart_item_id, product=product, user=request.user)
-        else:
-            cart = Cart.objects.get(cart_id=_cart_id(request))
-            cart_item = CartItem.objects.get(id=cart_item_id, product=product, cart=cart)
-        if cart_item.quantity > 1:
-            cart_item.quantity -= 1
-            cart_item.save()
-        else:
-            cart_item.delete()
-
-    except:
-        pass
+    if uses_cache_cart(request):
+        anonymous_cart = get_anonymous_cart(request)
+        if anonymous_cart:
+            anonymous_cart.remove(product.id, cart_item_id)
+        return redirect('cart')
+    cart_item = _owned_cart_item(request, product, cart_item_id)
+    with transaction.atomic():
+        # Decrement in the database, the last unit removes the line, so parallel
+        # clicks each take exactly one unit and never leave a zero-quantity line
+        if not cart_item.filter(quantity__gt=1).update(quantity=F('quantity') - 1):
+            cart_item.filter(quantity__lte=1).delete()
     return redirect('cart')
 
 def delete_cart_item(request, product_id, cart_item_id):
     product = get_object_or_404(Product, id=product_id)
-    try:
-        if request.user.is_authenticated:
-            cart_item = CartItem.objects.get(id=cart_item_id, product=product, user=request.user)
-            cart_item.delete()
-        else:
-            cart = Cart.objects.get(cart_id=_cart_id(request))
-            cart_item = CartItem.objects.get(id=cart_item_id, product=product, cart=cart)
-            cart_item.delete()
-
-    except:
-        pass
+    if uses_cache_cart(request):
+        anonymous_cart = get_anonymous_cart(request)
+        if anonymous_cart:
+            anonymous_cart.delete(product.id, cart_item_id)
+        return redirect('cart')
+    # Nothing to do when the line is already gone
+    _owned_cart_item(request, product, cart_item_id).delete()
     return redirect('cart')
 
-def cart(request, total=0, quantity=0, cart_items=None):
-    try:
-        # show cart if user is authenticated
-        if request.user.is_authenticated:
-            cart_items = CartItem.objects.filter(user=request.user, is_active=True)
-
-        else:
-            cart = Cart.objects.get(cart_id=_cart_id(request))
-            cart_items = CartItem.objects.filter(cart=cart, is_active=True)
-        for cart_item in cart_items:
-            total += (cart_item.product.price * cart_item.quantity)
-            quantity += cart_item.quantity
-        tax = (1.5 * total)/100
-        grand_total = total + tax
-    except ObjectDoesNotExist:
-        cart = None
-        cart_items = []
-        tax = 0
-        grand_total = 0
-
-    context = {
-        'total': total,
-        'quantity': quantity,
-        'cart_items': cart_items,
-        'tax': tax,
-        'grand_total': grand_total,
-    }
-    return render(request, 'shop/cart.html', context)
+def _cart_summary(request):
+    # Logged-in users own their lines, visitors only have a cart once they added something
+    if request.user.is_authenticated:
+        return get_cart_summary(user=request.user)
+    if uses_cache_cart(request):
+        anonymous_cart = get_anonymous_cart(request)
+        return CartSummary(anonymous_cart.items() if anonymous_cart else ())
+    cart_id = _cart_id(request, create=False)
+    if not cart_id:
+        return CartSummary()
+    return get_cart_summary(cart__cart_id=cart_id)
+
+
+def cart(request):
+    summary = _cart_summary(request)
+    return render(request, 'shop/cart.html', summary.context())
 
 @login_required(login_url=('login'))
-def checkout(request, total=0, quantity=0, cart_items=None):
-    try:
-        # show cart if user is authenticated
-        if request.user.is_authenticated:
-            cart_items = CartItem.objects.filter(user=request.user, is_active=True)
-
-        else:
-            cart = Cart.objects.get(cart_id=_cart_id(request))
-            cart_items = CartItem.objects.filter(cart=cart, is_active=True)
-        for cart_item in cart_items:
-            total += (cart_item.product.price * cart_item.quantity)
-            quantity += cart_item.quantity
-        tax = (1.5 * total)/100
-        grand_total = total + tax
-
-    except ObjectDoesNotExist:
-        cart = None
-        cart_items = []
-        tax = 0
-        grand_total = 0
-
-    context = {
-        'total': total,
-        'quantity': quantity,
-        'cart_items': cart_items,
-        'tax': tax,
-        'grand_total': grand_total,
-    }
-    return render(request, 'shop/checkout.html', context)
+def checkout(request):
+    summary = _cart_summary(request)
+    return render(request, 'shop/checkout.html', summary.context())
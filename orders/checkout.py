@@ -0,0 +1,116 @@
+"""
+Turning a paid order and the buyer's cart into ordered products.
+
+finalize_order runs as one transaction: the order is claimed, the cart lines
+become OrderedProduct rows (bulk inserts), stock is taken in a single
+conditional UPDATE and the cart is emptied. If any product doesn't have
+enough stock left the whole transaction rolls back and OutOfStock is raised,
+so concurrent checkouts can never push stock below zero.
+
+allocate_order_number hands out the order number before the order's only
+INSERT, from a per-day counter row.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from carts.models import CartItem
+from carts.summary import cart_items
+from orders.models import Order, OrderNumberCounter, OrderedProduct
+from shop.facets import refresh_product_facets
+from shop.models import Product
+from shop.page_cache import LISTINGS_TAG, invalidate_tags, product_tag
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class OutOfStock(CheckoutError):
+    def __init__(self, products):
+        self.products = products
+        names = ', '.join(product.product_name for product in products)
+        super().__init__(f'Not enough stock left for: {names}')
+
+
+def allocate_order_number(day=None):
+    """The next order number of the day: YYYYMMDD followed by the day's counter, at least 4 digits."""
+    day = day or timezone.localdate()
+    counter = OrderNumberCounter.objects.filter(day=day)
+    with transaction.atomic():
+        # The UPDATE locks the day's row until the number is read back
+        if not counter.update(last_number=F('last_number') + 1):
+            try:
+                with transaction.atomic():
+                    OrderNumberCounter.objects.create(day=day, last_number=1)
+            except IntegrityError:
+                # Another checkout created the day's counter first
+                counter.update(last_number=F('last_number') + 1)
+        number = counter.values_list('last_number', flat=True).get()
+    return f'{day:%Y%m%d}{number:04d}'
+
+
+def _take_stock(quantities):
+    """
+    Decrements stock for {product_id: quantity} in one UPDATE that only matches
+    products with enough stock, raises OutOfStock when any of them didn't match.
+    """
+    enough = Q()
+    for product_id, quantity in quantities.items():
+        enough |= Q(pk=product_id, stock__gte=quantity)
+    updated = Product.objects.filter(enough).update(stock=F('stock') - Case(
+        *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        output_field=IntegerField(),
+    ))
+    if updated != len(quantities):
+        short = [
+            product for product in Product.objects.filter(pk__in=quantities)
+            if product.stock < quantities[product.pk]
+        ]
+        raise OutOfStock(short)
+
+
+def finalize_order(order_number, user, payment):
+    """Marks the order paid and moves the user's cart into it, all or nothing."""
+    with transaction.atomic():
+        # Claiming the order with a conditional UPDATE makes a replayed payment a no-op
+        claimed = Order.objects.filter(
+            order_number=order_number, user=user, is_ordered=False
+        ).update(is_ordered=True, payment=payment)
+        if not claimed:
+            raise Order.DoesNotExist
+        order = Order.objects.get(order_number=order_number, user=user)
+
+        items = list(cart_items(user=user))
+        if not items:
+            raise CheckoutError('Your cart is empty')
+
+        quantities = {}
+        for item in items:
+            quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+        _take_stock(quantities)
+
+        ordered_products = OrderedProduct.objects.bulk_create(
+            OrderedProduct(
+                order=order,
+                payment=payment,
+                user=user,
+                product=item.product,
+                quantity=item.quantity,
+                product_price=item.product.price,
+                ordered=True,
+            )
+            for item in items
+        )
+        OrderedProduct.variations.through.objects.bulk_create(
+            OrderedProduct.variations.through(orderedproduct_id=ordered_product.pk, variation_id=variation.pk)
+            for ordered_product, item in zip(ordered_products, items)
+            for variation in item.variations.all()
+        )
+
+        CartItem.objects.filter(user=user).delete()
+
+        # Stock moved through update(), so the Product signals didn't run
+        refresh_product_facets(list(quantities))
+        invalidate_tags(LISTINGS_TAG, *[product_tag(product_id) for product_id in quantities])
+    return order
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:35
+
+import datetime
+
+from django.db import migrations, models
+
+
+def number_existing_orders(apps, schema_editor):
+    """
+    Gives orders with an empty or repeated order_number a unique one and starts
+    each day's counter above the numbers already used that day, so allocated
+    numbers can't collide with the old date + id ones.
+    """
+    Order = apps.get_model('orders', 'Order')
+    OrderNumberCounter = apps.get_model('orders', 'OrderNumberCounter')
+
+    taken = set(Order.objects.values_list('order_number', flat=True))
+    seen = set()
+    renumbered = []
+    last_numbers = {}
+    for order in Order.objects.order_by('pk').only('pk', 'order_number', 'created_at').iterator():
+        if not order.order_number or order.order_number in seen:
+            number = f'{order.created_at:%Y%m%d}{order.pk}'
+            while number in taken:
+                number += '0'
+            order.order_number = number
+            taken.add(number)
+            renumbered.append(order)
+        seen.add(order.order_number)
+
+        prefix, suffix = order.order_number[:8], order.order_number[8:]
+        try:
+            day = datetime.datetime.strptime(prefix, '%Y%m%d').date()
+        except ValueError:
+            continue
+        if suffix.isdigit():
+            last_numbers[day] = max(last_numbers.get(day, 0), int(suffix))
+
+    Order.objects.bulk_update(renumbered, ['order_number'], batch_size=500)
+    OrderNumberCounter.objects.bulk_create(
+        [OrderNumberCounter(day=day, last_number=number) for day, number in last_numbers.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_remove_orderedproduct_color_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderNumberCounter',
+            fields=[
+                ('day', models.DateField(primary_key=True, serialize=False)),
+                ('last_number', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(number_existing_orders, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='order_number',
+            field=models.CharField(max_length=20, unique=True),
+        ),
+    ]
@@ -13,6 +13,15 @@ class Payment(models.Model):
     def __str__(self):
         return self.payment_id
     
+class OrderNumberCounter(models.Model):
+    """Last order number handed out per day, see orders.checkout.allocate_order_number."""
+    day = models.DateField(primary_key=True)
+    last_number = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.day}: {self.last_number}'
+
+
 class Order(models.Model):
     STATUS = (
         ('New', 'New'),
@@ -23,7 +32,7 @@ class Order(models.Model):
 
     user = models.ForeignKey(Account, on_delete=models.SET_NULL, null=True)
     payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, blank=True, null=True)
-    order_number = models.CharField(max_length=20)
+    order_number = models.CharField(max_length=20, unique=True)
     first_name = models.CharField(max_length=50)
     last_name = models.CharField(max_length=50)
     phone_number = models.CharField(max_length=15)
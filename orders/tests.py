@@ -1,3 +1,142 @@
-from django.test import TestCase
+import json
+import sys
+import threading
+import time
+from datetime import date
 
-# Create your tests here.
+from django.db import connection
+from django.test import Client, TransactionTestCase
+from django.urls import reverse
+
+from accounts.models import Account
+from carts.models import CartItem
+from orders.checkout import allocate_order_number
+from orders.models import Order, OrderedProduct, Payment
+from shop.models import Product, Variation
+from utils.testing import use_temporary_media
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """Parallel checkouts of a scarce product must sell exactly the stock there is."""
+
+    buyers = 24
+    stock = 10
+
+    def setUp(self):
+        use_temporary_media(self, 'shirt.jpg', 'socks.jpg')
+        self.product = Product.objects.create(
+            product_name='Shirt', slug='shirt', price=10, stock=self.stock, product_image='shirt.jpg'
+        )
+        self.plenty = Product.objects.create(
+            product_name='Socks', slug='socks', price=2, stock=1000, product_image='socks.jpg'
+        )
+        self.color = Variation.objects.create(product=self.product, variation_category='color', variation_value='Red')
+        self.clients = []
+        for number in range(self.buyers):
+            user = Account.objects.create_user(
+                first_name='Buyer', last_name=str(number), username=f'buyer{number}',
+                email=f'buyer{number}@example.com',
+            )
+            line = CartItem.objects.create(
+                user=user, product=self.product, quantity=1, variation_key=str(self.color.pk)
+            )
+            line.variations.add(self.color)
+            CartItem.objects.create(user=user, product=self.plenty, quantity=3)
+            order = Order.objects.create(
+                user=user, order_number=f'TEST{number}', first_name='Buyer', last_name=str(number),
+                phone_number='1', email=user.email, address_line_1='Street', country='X', state='Y',
+                city='Z', order_total=38, tax=0,
+            )
+            client = Client()
+            client.force_login(user)
+            self.clients.append((client, order))
+        Account.objects.update(is_active=True)
+
+    def pay(self, client, order):
+        return client.post(reverse('payments'), json.dumps({
+            'order_number': order.order_number,
+            'payment_id': f'PAY-{order.order_number}',
+            'payment_method': 'PayPal',
+            'amount_paid': '38',
+            'status': 'COMPLETED',
+        }), content_type='application/json')
+
+    def test_parallel_checkouts_never_oversell(self):
+        statuses = []
+        errors = []
+        barrier = threading.Barrier(self.buyers)
+
+        def checkout(client, order):
+            try:
+                barrier.wait()
+                statuses.append(self.pay(client, order).status_code)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=checkout, args=pair) for pair in self.clients]
+        started = time.monotonic()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - started
+        sys.stderr.write(f"\n{self.buyers} checkouts in {elapsed:.2f}s ({self.buyers / elapsed:.0f} orders/s)\n")
+
+        self.assertEqual(errors, [])
+        self.assertEqual(statuses.count(200), self.stock)
+        self.assertEqual(statuses.count(409), self.buyers - self.stock)
+
+        self.product.refresh_from_db()
+        self.plenty.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+        self.assertEqual(self.plenty.stock, 1000 - 3 * self.stock)
+
+        # Rejected checkouts leave no trace: order unpaid, cart intact
+        self.assertEqual(Order.objects.filter(is_ordered=True).count(), self.stock)
+        self.assertEqual(Payment.objects.count(), self.stock)
+        self.assertEqual(OrderedProduct.objects.filter(product=self.product).count(), self.stock)
+        self.assertEqual(CartItem.objects.count(), 2 * (self.buyers - self.stock))
+        for ordered_product in OrderedProduct.objects.filter(product=self.product):
+            self.assertEqual(list(ordered_product.variations.all()), [self.color])
+
+    def test_replayed_payment_is_not_applied_twice(self):
+        client, order = self.clients[0]
+        self.assertEqual(self.pay(client, order).status_code, 200)
+        self.assertEqual(self.pay(client, order).status_code, 404)
+        self.assertEqual(Payment.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, self.stock - 1)
+        self.assertEqual(OrderedProduct.objects.filter(order=order).count(), 2)
+
+
+class OrderNumberTests(TransactionTestCase):
+    def test_numbers_are_unique_and_dated_across_threads(self):
+        numbers = []
+        errors = []
+        barrier = threading.Barrier(8)
+
+        def allocate():
+            try:
+                barrier.wait()
+                for _ in range(5):
+                    numbers.append(allocate_order_number(date(2026, 3, 7)))
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=allocate) for _ in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(numbers), [f'20260307{number:04d}' for number in range(1, 41)])
+
+    def test_each_day_counts_from_one(self):
+        self.assertEqual(allocate_order_number(date(2026, 3, 7)), '202603070001')
+        self.assertEqual(allocate_order_number(date(2026, 3, 8)), '202603080001')
+        self.assertEqual(allocate_order_number(date(2026, 3, 7)), '202603070002')
@@ -1,90 +1,55 @@
-import datetime
 from django.shortcuts import redirect, render
-from carts.models import CartItem
+from carts.summary import get_cart_summary
+from orders.checkout import OutOfStock, allocate_order_number, finalize_order
 from orders.forms import OrderForm
 from orders.models import Order, OrderedProduct, Payment
 import json
+from django.db import transaction
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from collections import defaultdict
 
 # Email Imports
 from django.core.mail import EmailMessage
+from outbox.mail import queue_email
 from django.template.loader import render_to_string
 from django.contrib.sites.shortcuts import get_current_site
 
 def payments(request):
     """
     Handles payment processing and order creation.
-    Processes PayPal payment data and creates OrderedProduct entries.
+    Records the PayPal payment and lets finalize_order turn the cart into
+    OrderedProduct entries, all in one transaction.
     """
     if request.method == 'POST':
         try:
             # Parse payment data from PayPal
             data = json.loads(request.body)
             
-            # Create payment record
-            payment = Payment.objects.create(
-                user=request.user,
-                payment_id=data['payment_id'],
-                payment_method=data['payment_method'],
-                amount_paid=data['amount_paid'],
-                status=data['status']
-            )
-            
-            # Get the order and update with payment
-            order = Order.objects.get(
-                order_number=data['order_number'], 
-                user=request.user,
-                is_ordered=False
-            )
-            order.is_ordered = True
-            order.payment = payment
-            order.save()
-            
-            # Move cart items to ordered products - Direct 1:1 mapping
-            cart_items = CartItem.objects.filter(user=request.user)
-            
-            for item in cart_items:
-                # Get variations for this cart item
-                item_variations = item.variations.all()
-                color = item_variations.filter(variation_category__iexact='color').first()
-                size = item_variations.filter(variation_category__iexact='size').first()
-                
-                # Create OrderedProduct entry
-                ordered_product = OrderedProduct.objects.create(
-                    order=order,
-                    payment=payment,
+            # Payment, order, ordered products, stock, cart and the confirmation
+            # email change together or not at all
+            with transaction.atomic():
+                payment = Payment.objects.create(
                     user=request.user,
-                    product=item.product,
-                    quantity=item.quantity,
-                    product_price=item.product.price,
-                    ordered=True
+                    payment_id=data['payment_id'],
+                    payment_method=data['payment_method'],
+                    amount_paid=data['amount_paid'],
+                    status=data['status']
                 )
-                
-                # Store variations in M2M field for reference
-                ordered_product.variations.set(item_variations)
-
-                # Reduce product stock
-                item.product.stock -= item.quantity
-                item.product.save()
-            
-            # Clear user's cart
-            cart_items.delete()
-            current_site = get_current_site(request)
-            mail_subject = "Order Confirmation - StoreFrenzy"
-            message = render_to_string('orders/emails/order_received_email.html', {
-                'user': request.user,
-                'order': order,
-                'domain': current_site.domain,
-            })
-            to_email = request.user.email
-            send_email = EmailMessage(mail_subject, message, to=[to_email])
-            send_email.content_subtype = 'html' 
-            send_email.send()
+                order = finalize_order(data['order_number'], request.user, payment)
 
+                current_site = get_current_site(request)
+                mail_subject = "Order Confirmation - StoreFrenzy"
+                message = render_to_string('orders/emails/order_received_email.html', {
+                    'user': request.user,
+                    'order': order,
+                    'domain': current_site.domain,
+                })
+                to_email = request.user.email
+                send_email = EmailMessage(mail_subject, message, to=[to_email])
+                send_email.content_subtype = 'html' 
+                queue_email(send_email)
 
-            
             return JsonResponse({
                 'success': True,
                 'redirect_url': f'/orders/order-complete/?order_number={order.order_number}&payment_id={payment.payment_id}'
@@ -95,6 +60,11 @@ def payments(request):
                 'success': False, 
                 'error': 'Order not found'
             }, status=404)
+        except OutOfStock as e:
+            return JsonResponse({
+                'success': False,
+                'error': str(e)
+            }, status=409)
         except Exception as e:
             return JsonResponse({
                 'success': False, 
@@ -106,7 +76,7 @@ def payments(request):
         'error': 'Invalid request method'
     }, status=400)
 
-def place_order(request, total=0, quantity=0):
+def place_order(request):
     """
     Creates order from cart and displays payment page.
     Validates cart and calculates totals before checkout.
@@ -114,21 +84,13 @@ def place_order(request, total=0, quantity=0):
     current_user = request.user
 
     # Redirect if cart is empty
-    cart_items = CartItem.objects.filter(user=current_user)
-    cart_count = cart_items.count()
-    if cart_count <= 0:
+    summary = get_cart_summary(user=current_user)
+    if not summary:
         return redirect('store')
     
-    # Calculate totals
-    grand_total = 0
-    tax = 0
-
-    for cart_item in cart_items:
-        total += (cart_item.product.price * cart_item.quantity)
-        quantity += cart_item.quantity
-    
-    tax = (1.5 * total) / 100
-    grand_total = total + tax
+    # Totals come from the cart summary
+    grand_total = summary.grand_total
+    tax = summary.tax
     
     if request.method == 'POST':
         form = OrderForm(request.POST)
@@ -149,31 +111,13 @@ def place_order(request, total=0, quantity=0):
             data.order_total = grand_total
             data.tax = tax
             data.ip = request.META.get('REMOTE_ADDR')
-            data.save()
-            
-            # Generate order number
-            yr = int(datetime.date.today().strftime('%Y'))
-            dt = int(datetime.date.today().strftime('%d'))
-            mt = int(datetime.date.today().strftime('%m'))
-            d = datetime.date(yr, mt, dt)
-            current_date = d.strftime("%Y%m%d")
-            order_number = current_date + str(data.id)
-            data.order_number = order_number
+            # Numbered before the insert, so the order is written once
+            data.order_number = allocate_order_number()
             data.save()
 
-            # Get order for payment page
-            order = Order.objects.get(
-                user=current_user, 
-                is_ordered=False, 
-                order_number=order_number
-            )
-            
             context = {
-                'order': order,
-                'cart_items': cart_items,
-                'total': total,
-                'tax': tax,
-                'grand_total': grand_total,
+                'order': data,
+                **summary.context(),
             }
             return render(request, 'orders/payments.html', context)
     
@@ -0,0 +1,19 @@
+"""
+Queueing email instead of sending it inside the request.
+
+    queue_email(EmailMessage(subject, body, to=[email]))
+
+stores the message in the outbox and returns immediately. Call it inside the
+transaction that makes the change the email is about. run_mail_worker
+delivers it through EMAIL_BACKEND (or --backend) with retries.
+"""
+from outbox.models import OutgoingEmail
+
+
+def queue_email(message):
+    """Stores a Django EmailMessage for the mail worker. Attachments aren't supported."""
+    if message.attachments:
+        raise ValueError('Outbox emails cannot carry attachments')
+    email = OutgoingEmail.from_message(message)
+    email.save()
+    return email
@@ -0,0 +1,143 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from django.utils import timezone
+
+from outbox.models import OutgoingEmail
+from utils.gmail_backend import GmailSendError
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued outbox emails with a pool of sender threads, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4,
+                            help='Number of send_messages calls made in parallel per batch')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Number of messages claimed from the outbox at a time')
+        parser.add_argument('--max-attempts', type=int, default=6,
+                            help='Attempts before a message is marked dead')
+        parser.add_argument('--backoff', type=float, default=30,
+                            help='Seconds before the first retry, doubling with every attempt')
+        parser.add_argument('--max-backoff', type=float, default=3600,
+                            help='Longest wait between two attempts, in seconds')
+        parser.add_argument('--lock-timeout', type=float, default=300,
+                            help='Seconds after which a claimed message is handed to another worker')
+        parser.add_argument('--poll-interval', type=float, default=5,
+                            help='Seconds to wait when the outbox is empty')
+        parser.add_argument('--backend', default=None,
+                            help='Email backend to deliver with, defaults to EMAIL_BACKEND')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once no message is due instead of polling')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.backend = options['backend'] or settings.EMAIL_BACKEND
+        self.local = threading.local()
+        self.stats = {'sent': 0, 'retried': 0, 'dead': 0}
+
+        with ThreadPoolExecutor(max_workers=options['threads'], thread_name_prefix='mail-worker') as executor:
+            try:
+                while True:
+                    token, batch = self.claim()
+                    if not batch:
+                        if options['once']:
+                            break
+                        time.sleep(options['poll_interval'])
+                        continue
+                    # Each thread hands its share of the batch to one send_messages() call,
+                    # which GmailAPIBackend sends as Gmail batch requests
+                    share = -(-len(batch) // options['threads'])
+                    chunks = [batch[start:start + share] for start in range(0, len(batch), share)]
+                    errors = [error for chunk_errors in executor.map(self.deliver, chunks) for error in chunk_errors]
+                    self.record(token, batch, errors)
+            except KeyboardInterrupt:
+                pass
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {self.stats['sent']} emails, {self.stats['retried']} to retry, {self.stats['dead']} dead."
+        ))
+
+    def due(self, now):
+        # Pending messages whose time has come, and claims left behind by a crashed worker
+        return Q(status=OutgoingEmail.PENDING, next_attempt_at__lte=now) | Q(
+            status=OutgoingEmail.SENDING, locked_until__lt=now
+        )
+
+    def claim(self):
+        """Marks a batch of due messages as ours, a parallel worker's UPDATE can't match them any more."""
+        now = timezone.now()
+        token = uuid.uuid4().hex
+        pks = list(
+            OutgoingEmail.objects.filter(self.due(now))
+            .order_by('next_attempt_at', 'pk')
+            .values_list('pk', flat=True)[:self.options['batch_size']]
+        )
+        if not pks:
+            return token, []
+        OutgoingEmail.objects.filter(self.due(now), pk__in=pks).update(
+            status=OutgoingEmail.SENDING,
+            claim=token,
+            locked_until=now + timedelta(seconds=self.options['lock_timeout']),
+        )
+        return token, list(OutgoingEmail.objects.filter(claim=token).order_by('pk'))
+
+    def connection(self):
+        # One backend connection per sender thread, backends aren't shared between threads
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = get_connection(self.backend, fail_silently=False)
+        return connection
+
+    def deliver(self, emails):
+        """Sends messages from a pool thread in one call, returns the error text or None for each."""
+        messages = [email.to_message() for email in emails]
+        try:
+            sent = self.connection().send_messages(messages)
+        except GmailSendError as error:
+            # Per-message outcomes, in the order the messages were given
+            return [None if failure is None else f'{type(failure).__name__}: {failure}'
+                    for _, _, failure in error.results]
+        except Exception as error:
+            # Start from a fresh connection after a failure
+            self.local.connection = None
+            return [f'{type(error).__name__}: {error}'] * len(emails)
+        if sent == len(messages):
+            return [None] * len(emails)
+        # Other backends only report a count, so none of these can be told apart
+        return [f'The backend sent {sent or 0} of {len(messages)} messages'] * len(emails)
+
+    def record(self, token, batch, errors):
+        now = timezone.now()
+        mine = OutgoingEmail.objects.filter(claim=token)
+        sent = [email.pk for email, error in zip(batch, errors) if error is None]
+        if sent:
+            mine.filter(pk__in=sent).update(
+                status=OutgoingEmail.SENT, sent_at=now, attempts=F('attempts') + 1,
+                claim='', locked_until=None, last_error='',
+            )
+            self.stats['sent'] += len(sent)
+
+        for email, error in zip(batch, errors):
+            if error is None:
+                continue
+            attempts = email.attempts + 1
+            if attempts >= self.options['max_attempts']:
+                status = OutgoingEmail.DEAD
+                self.stats['dead'] += 1
+                self.stderr.write(f"Giving up on email {email.pk} to {', '.join(email.to)}: {error}")
+            else:
+                status = OutgoingEmail.PENDING
+                self.stats['retried'] += 1
+            delay = min(self.options['backoff'] * 2 ** (attempts - 1), self.options['max_backoff'])
+            mine.filter(pk=email.pk).update(
+                status=status, attempts=attempts, last_error=error,
+                next_attempt_at=now + timedelta(seconds=delay), claim='', locked_until=None,
+            )
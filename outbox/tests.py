@@ -0,0 +1,232 @@
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from outbox.mail import queue_email
+from outbox.models import OutgoingEmail
+from shop.models import GmailToken
+from utils.generate_credentials import GmailCredentialsManager, clear_cached_credentials, get_cached_credentials
+from utils.gmail_backend import GmailAPIBackend, GmailSendError
+from utils.gmail_fake import FakeGmailHttp
+
+
+class FailingBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise ConnectionError('Gmail is down')
+
+
+class MailWorkerTests(TestCase):
+    def queue(self, count=1):
+        for number in range(count):
+            message = EmailMessage(f'Order {number}', '<p>Thanks</p>', to=[f'buyer{number}@example.com'])
+            message.content_subtype = 'html'
+            queue_email(message)
+
+    def work(self, *args):
+        call_command('run_mail_worker', '--once', *args, stdout=StringIO(), stderr=StringIO())
+
+    def test_queueing_does_not_send(self):
+        self.queue()
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(OutgoingEmail.objects.get().status, OutgoingEmail.PENDING)
+
+    def test_worker_delivers_through_the_backend(self):
+        self.queue(5)
+        self.work('--threads', '3', '--batch-size', '2')
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [f'buyer{n}@example.com' for n in range(5)])
+        self.assertEqual(mail.outbox[0].content_subtype, 'html')
+        self.assertFalse(OutgoingEmail.objects.exclude(status=OutgoingEmail.SENT).exists())
+
+    def test_file_backend_stands_in_for_gmail(self):
+        self.queue(2)
+        with tempfile.TemporaryDirectory() as directory, self.settings(EMAIL_FILE_PATH=directory):
+            self.work('--backend', 'django.core.mail.backends.filebased.EmailBackend')
+            written = ''.join(path.read_text() for path in Path(directory).iterdir())
+        self.assertIn('buyer0@example.com', written)
+        self.assertIn('buyer1@example.com', written)
+
+    def test_failures_back_off_then_go_dead(self):
+        self.queue()
+        failing = 'outbox.tests.FailingBackend'
+        self.work('--backend', failing, '--backoff', '60')
+        email = OutgoingEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.PENDING, 1))
+        self.assertIn('Gmail is down', email.last_error)
+        self.assertGreater(email.next_attempt_at, timezone.now())
+
+        # Not due yet, a second run leaves it alone
+        self.work('--backend', failing)
+        self.assertEqual(OutgoingEmail.objects.get().attempts, 1)
+
+        OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+        self.work('--backend', failing, '--max-attempts', '2')
+        email = OutgoingEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.DEAD, 2))
+
+    def test_abandoned_claims_are_picked_up(self):
+        self.queue()
+        OutgoingEmail.objects.update(
+            status=OutgoingEmail.SENDING, claim='crashed', locked_until=timezone.now() - timedelta(seconds=1)
+        )
+        self.work()
+        self.assertEqual(OutgoingEmail.objects.get().status, OutgoingEmail.SENT)
+        self.assertEqual(len(mail.outbox), 1)
+
+
+@override_settings(GMAIL_HTTP_TRANSPORT='utils.gmail_fake.FakeGmailHttp')
+class GmailBackendTests(TestCase):
+    """GmailAPIBackend against the offline fake transport."""
+
+    def setUp(self):
+        GmailToken.objects.create(
+            access_token='token', refresh_token='refresh', token_expiry=timezone.now() + timedelta(hours=1)
+        )
+        clear_cached_credentials()
+        FakeGmailHttp.reset()
+        self.addCleanup(FakeGmailHttp.reset)
+        self.addCleanup(clear_cached_credentials)
+
+    def messages(self, count):
+        return [EmailMessage('Hello', 'Body', to=[f'user{number}@example.com']) for number in range(count)]
+
+    def test_many_messages_go_out_in_batches_with_per_message_results(self):
+        FakeGmailHttp.FAIL_TO = {'user7@example.com'}
+        with self.assertRaises(GmailSendError) as raised:
+            GmailAPIBackend().send_messages(self.messages(60))
+
+        self.assertEqual(len(FakeGmailHttp.REQUESTS), 2)
+        self.assertEqual(len(FakeGmailHttp.SENT), 59)
+        failed = [message.to for message, message_id, error in raised.exception.results if error is not None]
+        self.assertEqual(failed, [['user7@example.com']])
+        self.assertEqual(GmailAPIBackend(fail_silently=True).send_messages(self.messages(8)), 7)
+
+    def test_worker_sends_claimed_batches_in_one_call(self):
+        # Loads the credentials here, the worker's pool threads can't see this test's transaction
+        get_cached_credentials()
+        FakeGmailHttp.FAIL_TO = {'user7@example.com'}
+        for message in self.messages(60):
+            queue_email(message)
+        call_command(
+            'run_mail_worker', '--once', '--threads', '1', '--batch-size', '60',
+            '--backend', 'utils.gmail_backend.GmailAPIBackend', stdout=StringIO(), stderr=StringIO(),
+        )
+
+        # 60 messages in two Gmail batch requests, each outcome recorded on its own row
+        self.assertEqual(len(FakeGmailHttp.REQUESTS), 2)
+        self.assertEqual(OutgoingEmail.objects.filter(status=OutgoingEmail.SENT).count(), 59)
+        failed = OutgoingEmail.objects.exclude(status=OutgoingEmail.SENT).get()
+        self.assertEqual((failed.to, failed.status, failed.attempts), (['user7@example.com'], OutgoingEmail.PENDING, 1))
+        self.assertIn('Invalid To header', failed.last_error)
+
+    def test_service_and_credentials_are_reused(self):
+        GmailAPIBackend().send_messages(self.messages(1))
+        with self.assertNumQueries(0):
+            for message in self.messages(5):
+                self.assertEqual(GmailAPIBackend().send_messages([message]), 1)
+        self.assertEqual(len(FakeGmailHttp.SENT), 6)
+
+    def test_threads_send_in_parallel(self):
+        GmailAPIBackend().send_messages(self.messages(1))
+        errors = []
+
+        def send(messages):
+            try:
+                for message in messages:
+                    GmailAPIBackend().send_messages([message])
+            except Exception as error:
+                errors.append(error)
+
+        workers = [threading.Thread(target=send, args=(self.messages(10),)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(FakeGmailHttp.SENT), 41)
+
+
+class GmailCredentialsTests(TransactionTestCase):
+    """Token refreshes happen once, whatever the number of threads or workers asking."""
+
+    def setUp(self):
+        clear_cached_credentials()
+        self.addCleanup(clear_cached_credentials)
+        self.refreshes = 0
+        self.refresh_lock = threading.Lock()
+
+    def token(self, expires_in):
+        GmailToken.objects.create(
+            access_token='old', refresh_token='refresh', token_expiry=timezone.now() + expires_in
+        )
+
+    def fake_refresh(self, creds, request):
+        # The HTTP call must not hold the database write lock
+        self.assertFalse(connection.in_atomic_block)
+        with self.refresh_lock:
+            self.refreshes += 1
+        time.sleep(0.05)
+        creds.token = 'new'
+        creds.expiry = (timezone.now() + timedelta(hours=1)).replace(tzinfo=None)
+
+    def in_threads(self, target, count=8):
+        tokens = []
+
+        def run():
+            try:
+                tokens.append(target().token)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=run) for _ in range(count)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return tokens
+
+    def test_expired_token_is_refreshed_once_per_process(self):
+        self.token(-timedelta(minutes=1))
+        with mock.patch('google.oauth2.credentials.Credentials.refresh', autospec=True, side_effect=self.fake_refresh):
+            tokens = self.in_threads(get_cached_credentials)
+        self.assertEqual(tokens, ['new'] * 8)
+        self.assertEqual(self.refreshes, 1)
+        self.assertEqual(GmailToken.objects.get().access_token, 'new')
+
+    def test_workers_share_one_refresh_through_the_claim(self):
+        # Separate managers without the in-process cache, like separate worker processes
+        self.token(-timedelta(minutes=1))
+        with mock.patch('google.oauth2.credentials.Credentials.refresh', autospec=True, side_effect=self.fake_refresh):
+            tokens = self.in_threads(lambda: GmailCredentialsManager().get_fresh_credentials(), count=4)
+        self.assertEqual(tokens, ['new'] * 4)
+        self.assertEqual(self.refreshes, 1)
+        self.assertIsNone(GmailToken.objects.get().refresh_claimed_until)
+
+    def test_failed_refresh_releases_the_claim(self):
+        self.token(timedelta(minutes=8))
+        with mock.patch('google.oauth2.credentials.Credentials.refresh', autospec=True, side_effect=OSError('offline')):
+            # Still valid, so the old token is used while the refresh fails
+            self.assertEqual(GmailCredentialsManager().get_fresh_credentials(refresh_ahead=True).token, 'old')
+        self.assertIsNone(GmailToken.objects.get().refresh_claimed_until)
+
+    def test_token_is_refreshed_in_the_background_before_it_expires(self):
+        self.token(timedelta(minutes=8))
+        with mock.patch('google.oauth2.credentials.Credentials.refresh', autospec=True, side_effect=self.fake_refresh):
+            # Still valid: handed out right away while the refresh runs
+            self.assertEqual(get_cached_credentials().token, 'old')
+            deadline = time.monotonic() + 5
+            while get_cached_credentials().token != 'new' and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(get_cached_credentials().token, 'new')
+        self.assertEqual(self.refreshes, 1)
@@ -1,22 +1,43 @@
 from django.contrib import admin
+from django.utils.html import format_html
 from .models import Category, Product, ProductGallery, Variation, ReviewRating
-import admin_thumbnails
+from .templatetags.shop_images import image_url
+
+
+def image_preview(instance, field_name):
+    """80px preview from the 160px variant (sharp on 2x screens), the original only when there is none."""
+    url = image_url(instance, field_name, 160)
+    if not url:
+        return '-'
+    return format_html('<img src="{}" width="80" loading="lazy" alt="">', url)
+
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ('category_name', 'slug')
+    list_display = ('category_name', 'slug', 'category_image_preview')
     prepopulated_fields = {'slug': ('category_name',)}
+    readonly_fields = ('category_image_preview',)
+
+    @admin.display(description='Preview')
+    def category_image_preview(self, obj):
+        return image_preview(obj, 'category_image')
 
 
-@admin_thumbnails.thumbnail('images')
 class ProductGalleryInline(admin.TabularInline):
     model = ProductGallery
     extra = 1
+    fields = ('images', 'images_preview')
+    readonly_fields = ('images_preview',)
+
+    @admin.display(description='Preview')
+    def images_preview(self, obj):
+        return image_preview(obj, 'images')
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('product_name', 'slug', 'price', 'stock', 'is_available', 'display_categories')
+    list_display = ('product_name', 'slug', 'price', 'stock', 'is_available', 'display_categories', 'avg_rating', 'review_count')
     list_filter = ('is_available', 'created_date', 'modified_date',)
+    readonly_fields = ('product_image_preview', 'avg_rating', 'review_count', 'rating_5_count', 'rating_4_count', 'rating_3_count', 'rating_2_count', 'rating_1_count')
     search_fields = ('product_name',)
     prepopulated_fields = {'slug': ('product_name',)}
     filter_horizontal = ('category',)
@@ -26,9 +47,13 @@ class ProductAdmin(admin.ModelAdmin):
         return ", ".join([cat.category_name for cat in obj.category.all()])
     display_categories.short_description = 'Categories'
 
+    @admin.display(description='Image preview')
+    def product_image_preview(self, obj):
+        return image_preview(obj, 'product_image')
+
     fieldsets = [
         ('Basic Information', {
-            'fields': ('product_name', 'slug', 'price', 'stock', 'product_content', 'product_image', 'short_description')
+            'fields': ('product_name', 'slug', 'price', 'stock', 'product_content', 'product_image', 'product_image_preview', 'short_description')
         }),
         ('Products Settings', {
             'fields': ('category', 'is_available'),
@@ -37,6 +62,10 @@ class ProductAdmin(admin.ModelAdmin):
             'fields': ('seo_description', 'seo_keywords'),
             'classes': ('collapse',)
         }),
+        ('Ratings', {
+            'fields': ('avg_rating', 'review_count', 'rating_5_count', 'rating_4_count', 'rating_3_count', 'rating_2_count', 'rating_1_count'),
+            'classes': ('collapse',)
+        }),
     ]
 
 @admin.register(Variation)
@@ -47,8 +76,13 @@ class VariationAdmin(admin.ModelAdmin):
 
 @admin.register(ReviewRating)
 class ReviewRatingAdmin(admin.ModelAdmin):
-    list_display = ('product', 'review')
+    list_display = ('product', 'review', 'rating', 'status')
+    list_filter = ('status',)
 
 @admin.register(ProductGallery)
 class ProductGalleryAdmin(admin.ModelAdmin):
-    list_display = ('product',)
\ No newline at end of file
+    list_display = ('product', 'images_preview')
+
+    @admin.display(description='Preview')
+    def images_preview(self, obj):
+        return image_preview(obj, 'images')
\ No newline at end of file
@@ -1,9 +1,82 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
 from shop.models import Category
+from shop.page_cache import CART_COUNT_PLACEHOLDER, CSRF_PLACEHOLDER
+
+CATEGORIES_VERSION_KEY = 'shop:categories:version'
+CATEGORIES_KEY = 'shop:categories:%s'
+# Changes made without signals (queryset updates, raw SQL) show up after this long at most
+CATEGORIES_TIMEOUT = 10 * 60
+# How long the process-local copy is used before the shared version is checked again
+CATEGORIES_RECHECK = 30
+
+# Process-local (version, categories, recheck at, expires), refetched when the shared version moves
+_local = (None, None, 0, 0)
+
+
+def get_category_list():
+    """
+    Categories ordered for navigation, each with product_count of available products.
+    Served from a process-local copy, then the shared cache, then the database.
+    """
+    global _local
+    now = time.monotonic()
+    local_version, local_categories, recheck_at, expires = _local
+    if now < recheck_at:
+        return local_categories
+
+    version = cache.get(CATEGORIES_VERSION_KEY, 0)
+    if local_version == version and now < expires:
+        _local = (version, local_categories, min(now + CATEGORIES_RECHECK, expires), expires)
+        return local_categories
+
+    categories = cache.get(CATEGORIES_KEY % version)
+    if categories is None:
+        categories = list(
+            Category.objects.annotate(
+                product_count=Count('products', filter=Q(products__is_available=True))
+            ).order_by('order')
+        )
+        cache.set(CATEGORIES_KEY % version, categories, CATEGORIES_TIMEOUT)
+
+    _local = (version, categories, now + CATEGORIES_RECHECK, now + CATEGORIES_TIMEOUT)
+    return categories
+
+
+def invalidate_categories():
+    """Bumps the category list version once the current transaction commits."""
+    def bump():
+        global _local
+        # This process sees its own change right away, the others within CATEGORIES_RECHECK
+        _local = (None, None, 0, 0)
+        cache.add(CATEGORIES_VERSION_KEY, 0, None)
+        try:
+            cache.incr(CATEGORIES_VERSION_KEY)
+        except ValueError:
+            cache.delete(CATEGORIES_VERSION_KEY)
+    transaction.on_commit(bump)
+
 
 def get_categories(request):
-    categories = list(Category.objects.all().order_by('order'))
     return {
-        'categories': categories
+        'categories': get_category_list()
+    }
+
+def page_cache_placeholders(request):
+    """
+    While a page is rendered for the anonymous page cache, the per-visitor values
+    are left as placeholders for shop.page_cache to fill in on each hit. Listed
+    last so it overrides the csrf and cart counter processors.
+    """
+    if not getattr(request, 'page_cache_fill', False):
+        return {}
+    return {
+        'csrf_token': CSRF_PLACEHOLDER,
+        'cart_count': CART_COUNT_PLACEHOLDER,
     }
 
 # def get_categories(request):
@@ -0,0 +1,240 @@
+"""
+Faceted navigation for the store page.
+
+Every available product has one ProductFacet row per facet value it carries
+(category, price band, color, size, availability, and each rating threshold it
+meets). refresh_product_facets() rewrites those rows when a product, variation,
+review or category changes, and records the changed products as a FacetChange
+row.
+
+Each process holds the whole index in memory as {(facet, value): {product ids}}
+and catches up on the FacetChange rows it hasn't seen before answering, so facet counts are set
+intersections, never GROUP BY queries. Listings filter through the indexed
+ProductFacet table with one subquery per selected facet.
+"""
+import threading
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from shop.models import FacetChange, Product, ProductFacet, Variation
+
+
+FACETS = (
+    ('category', 'Categories'),
+    ('price', 'Price Range'),
+    ('color', 'Colors'),
+    ('size', 'Sizes'),
+    ('availability', 'Availability'),
+    ('rating', 'Customer Rating'),
+)
+
+PRICE_BANDS = (
+    ('0-50', 0, 50, '$0 - $50'),
+    ('50-100', 50, 100, '$50 - $100'),
+    ('100-200', 100, 200, '$100 - $200'),
+    ('200-500', 200, 500, '$200 - $500'),
+    ('500-1000', 500, 1000, '$500 - $1000'),
+    ('1000+', 1000, None, '$1000+'),
+)
+
+RATING_THRESHOLDS = (4, 3, 2, 1)
+
+# Processes further behind than this reload the whole index
+CHANGES_TIMEOUT = timedelta(hours=1)
+
+
+def price_band(price):
+    for value, low, high, label in PRICE_BANDS:
+        if price >= low and (high is None or price < high):
+            return value, label
+    return PRICE_BANDS[0][0], PRICE_BANDS[0][3]
+
+
+def refresh_product_facets(product_ids):
+    """Rewrites the facet rows of the given products in a handful of queries."""
+    product_ids = list(set(product_ids))
+    if not product_ids:
+        return
+
+    products = Product.objects.filter(pk__in=product_ids, is_available=True).only(
+        'pk', 'price', 'stock', 'avg_rating', 'review_count'
+    )
+    memberships = Product.category.through.objects.filter(product_id__in=product_ids).values_list(
+        'product_id', 'category__slug', 'category__category_name'
+    )
+    variations = Variation.objects.filter(product_id__in=product_ids, is_active=True).values_list(
+        'product_id', 'variation_category', 'variation_value'
+    )
+
+    rows = {}
+    for product in products:
+        facets = rows.setdefault(product.pk, {})
+        band, band_label = price_band(product.price)
+        facets[('price', band)] = band_label
+        if product.stock > 0:
+            facets[('availability', 'in_stock')] = 'In Stock'
+        else:
+            facets[('availability', 'out_of_stock')] = 'Out of Stock'
+        if product.review_count:
+            for threshold in RATING_THRESHOLDS:
+                if product.avg_rating >= threshold:
+                    facets[('rating', str(threshold))] = f'{threshold} stars & up'
+    for product_id, slug, name in memberships:
+        if product_id in rows:
+            rows[product_id][('category', slug)] = name
+    for product_id, category, value in variations:
+        if product_id in rows:
+            rows[product_id][(category, value.strip().lower())] = value.strip()
+
+    with transaction.atomic():
+        ProductFacet.objects.filter(product_id__in=product_ids).delete()
+        ProductFacet.objects.bulk_create([
+            ProductFacet(product_id=product_id, facet=facet, value=value, label=label)
+            for product_id, facets in rows.items()
+            for (facet, value), label in facets.items()
+        ], batch_size=1000)
+        transaction.on_commit(lambda: publish_changes(product_ids))
+
+
+def publish_changes(product_ids):
+    """Records changed products under a new index version (the row's pk) for other processes."""
+    FacetChange.objects.create(product_ids=product_ids)
+    FacetChange.objects.filter(created_at__lt=timezone.now() - CHANGES_TIMEOUT).delete()
+
+
+class FacetIndex:
+    """Process-local copy of the ProductFacet table as sets of product ids."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.version = None
+        self.products = {}
+        self.values = {}
+        self.labels = {}
+
+    def _add_rows(self, rows):
+        for product_id, facet, value, label in rows:
+            key = (facet, value)
+            self.products.setdefault(product_id, set()).add(key)
+            self.values.setdefault(key, set()).add(product_id)
+            self.labels[key] = label
+
+    def _load(self, version):
+        self.products, self.values, self.labels = {}, {}, {}
+        self._add_rows(ProductFacet.objects.values_list('product_id', 'facet', 'value', 'label').iterator())
+        self.version = version
+
+    def _apply(self, product_ids, version):
+        for product_id in product_ids:
+            for key in self.products.pop(product_id, ()):
+                self.values[key].discard(product_id)
+        self._add_rows(ProductFacet.objects.filter(product_id__in=product_ids).values_list(
+            'product_id', 'facet', 'value', 'label'
+        ))
+        self.version = version
+
+    def sync(self):
+        current = FacetChange.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        if current == self.version:
+            return self
+        with self.lock:
+            if self.version is None or current < self.version:
+                self._load(current)
+                return self
+            changes = list(
+                FacetChange.objects.filter(pk__gt=self.version, pk__lte=current)
+                .order_by('pk').values_list('pk', 'product_ids')
+            )
+            if not changes or changes[0][0] != self.version + 1:
+                # The changes right after our version were pruned, start over
+                self._load(current)
+                return self
+            changed = set()
+            for _, product_ids in changes:
+                changed.update(product_ids)
+            if changed:
+                self._apply(changed, current)
+            self.version = current
+        return self
+
+    def matching(self, selected, skip=None):
+        """
+        Product ids matching every selected facet (values OR'd within a facet),
+        or None when nothing is selected.
+        """
+        with self.lock:
+            result = None
+            for facet, values in selected.items():
+                if facet == skip or not values:
+                    continue
+                ids = set()
+                for value in values:
+                    ids |= self.values.get((facet, value), set())
+                result = ids if result is None else result & ids
+            return result
+
+    def count(self, selected):
+        matching = self.matching(selected)
+        return len(self.products) if matching is None else len(matching)
+
+    def counts(self, selected):
+        """
+        Facet panels for the template. Each facet's counts apply every other
+        selected facet, so picking a color still shows the other colors' counts.
+        """
+        with self.lock:
+            bases = {facet: self.matching(selected, skip=facet) for facet, _ in FACETS}
+            options = {facet: [] for facet, _ in FACETS}
+            for (facet, value), ids in self.values.items():
+                if facet not in bases:
+                    continue
+                base = bases[facet]
+                count = len(ids) if base is None else len(base & ids)
+                is_selected = value in selected.get(facet, ())
+                if count or is_selected:
+                    options[facet].append({
+                        'value': value,
+                        'label': self.labels[(facet, value)],
+                        'count': count,
+                        'selected': is_selected,
+                    })
+
+        panels = []
+        for facet, title in FACETS:
+            if options[facet]:
+                options[facet].sort(key=lambda option: _option_order(facet, option))
+                panels.append({'name': facet, 'title': title, 'options': options[facet]})
+        return panels
+
+
+def _option_order(facet, option):
+    if facet == 'price':
+        return [band[0] for band in PRICE_BANDS].index(option['value'])
+    if facet == 'rating':
+        return -int(option['value'])
+    return option['label'].lower()
+
+
+_index = FacetIndex()
+
+
+def get_facet_index():
+    return _index.sync()
+
+
+def selected_facets(request, **fixed):
+    """Facet filters from the query string, e.g. ?color=red&color=blue&price=0-50."""
+    selected = {facet: request.GET.getlist(facet) for facet, _ in FACETS}
+    for facet, value in fixed.items():
+        selected[facet] = [value]
+    return {facet: values for facet, values in selected.items() if values}
+
+
+def filter_products(products, selected):
+    for facet, values in selected.items():
+        products = products.filter(
+            pk__in=ProductFacet.objects.filter(facet=facet, value__in=values).values('product_id')
+        )
+    return products
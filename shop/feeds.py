@@ -0,0 +1,78 @@
+"""
+Product feed export for marketplaces and price-comparison sites.
+
+The feed is produced as a generator of text chunks so it can be written to a
+file by the export_product_feed command or streamed by the product_feed view.
+Products are read with iterator(chunk_size=...) and only the feed columns;
+URLs come from the denormalized primary_category_slug, so the export runs in
+one query per chunk however large the catalog is.
+"""
+import csv
+import json
+from xml.sax.saxutils import escape
+
+from shop.models import Product
+
+
+FEED_FIELDS = ('name', 'slug', 'price', 'stock', 'availability', 'url', 'image_url', 'avg_rating', 'review_count')
+FEED_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+    'xml': 'application/xml; charset=utf-8',
+}
+CHUNK_SIZE = 2000
+
+
+def feed_rows(base_url, chunk_size=CHUNK_SIZE):
+    """One dict per product, base_url ('https://shop.example') makes the URLs absolute."""
+    base_url = base_url.rstrip('/')
+    products = Product.objects.order_by('pk').only(
+        'pk', 'product_name', 'slug', 'price', 'stock', 'is_available', 'primary_category_slug',
+        'product_image', 'avg_rating', 'review_count',
+    )
+    for product in products.iterator(chunk_size=chunk_size):
+        url = product.get_url()
+        yield {
+            'name': product.product_name,
+            'slug': product.slug,
+            'price': product.price,
+            'stock': product.stock,
+            'availability': 'in stock' if product.is_available and product.stock > 0 else 'out of stock',
+            'url': base_url + url if url != '#' else '',
+            'image_url': base_url + product.product_image.url if product.product_image else '',
+            'avg_rating': round(product.avg_rating, 2),
+            'review_count': product.review_count,
+        }
+
+
+class _Line:
+    """File-like target for csv.writer that hands back each written line."""
+
+    def write(self, value):
+        return value
+
+
+def csv_feed(rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(FEED_FIELDS)
+    for row in rows:
+        yield writer.writerow([row[field] for field in FEED_FIELDS])
+
+
+def jsonl_feed(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+def xml_feed(rows):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<products>\n'
+    for row in rows:
+        fields = ''.join(f'<{field}>{escape(str(row[field]))}</{field}>' for field in FEED_FIELDS)
+        yield f'  <product>{fields}</product>\n'
+    yield '</products>\n'
+
+
+def product_feed(feed_format, base_url, chunk_size=CHUNK_SIZE):
+    """The feed in feed_format ('csv', 'jsonl' or 'xml') as a generator of text chunks."""
+    writers = {'csv': csv_feed, 'jsonl': jsonl_feed, 'xml': xml_feed}
+    return writers[feed_format](feed_rows(base_url, chunk_size))
@@ -0,0 +1,120 @@
+"""
+Responsive image variants for product, gallery and category images.
+
+Each uploaded image gets fixed-width WebP and JPEG copies next to it, e.g.
+products/variants/shirt-320.webp, and the model row stores the original's
+dimensions and the variant list in <field>_width, <field>_height and
+<field>_variants. Templates build srcset attributes from that JSON without
+touching the files (shop.templatetags.shop_images).
+
+Variants are built when an image is saved (shop.signals) and backfilled with
+the build_image_variants command.
+"""
+import logging
+import os
+from io import BytesIO
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = (160, 320, 640, 1280)
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+ORIENTATION_TAG = 0x0112
+
+# (model label, image field) pairs that get variants
+IMAGE_FIELDS = (
+    ('shop.Product', 'product_image'),
+    ('shop.ProductGallery', 'images'),
+    ('shop.Category', 'category_image'),
+)
+
+
+def variant_name(name, width, extension):
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return f'{directory}/variants/{stem}-{width}.{extension}'.lstrip('/')
+
+
+def _save(storage, name, image, **params):
+    buffer = BytesIO()
+    image.save(buffer, **params)
+    if storage.exists(name):
+        storage.delete(name)
+    return storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def build_variants(storage, name):
+    """
+    Writes the variants of one stored image and returns
+    (width, height, {'source': name, 'sizes': [{width, height, webp, jpeg}, ...]}).
+    Widths at or above the original's are skipped, the original covers those.
+    """
+    with storage.open(name, 'rb') as file, Image.open(file) as image:
+        stored_width, stored_height = image.size
+        # EXIF orientations 5-8 are rotated by 90 degrees
+        rotated = image.getexif().get(ORIENTATION_TAG, 1) in (5, 6, 7, 8)
+        width, height = (stored_height, stored_width) if rotated else (stored_width, stored_height)
+        widths = [w for w in VARIANT_WIDTHS if w < width]
+        if widths and image.format == 'JPEG':
+            # Let the JPEG decoder downscale while reading instead of in memory
+            scale = max(widths) / width
+            image.draft('RGB', (int(stored_width * scale), int(stored_height * scale)))
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+        sizes = []
+        for variant_width in sorted(widths, reverse=True):
+            variant_height = max(round(height * variant_width / width), 1)
+            image = image.resize((variant_width, variant_height), Image.Resampling.LANCZOS)
+            flat = image
+            if has_alpha:
+                flat = Image.new('RGB', image.size, 'white')
+                flat.paste(image, mask=image.getchannel('A'))
+            sizes.append({
+                'width': variant_width,
+                'height': variant_height,
+                'webp': _save(storage, variant_name(name, variant_width, 'webp'), image,
+                              format='WEBP', quality=WEBP_QUALITY, method=4),
+                'jpeg': _save(storage, variant_name(name, variant_width, 'jpg'), flat,
+                              format='JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True),
+            })
+    sizes.reverse()
+    return width, height, {'source': name, 'sizes': sizes}
+
+
+def build_field_variants(model_label, field_name, name):
+    """build_variants() for a model field's storage, picklable for worker processes."""
+    storage = apps.get_model(model_label)._meta.get_field(field_name).storage
+    return build_variants(storage, name)
+
+
+def needs_variants(instance, field_name):
+    name = getattr(instance, field_name).name
+    variants = getattr(instance, f'{field_name}_variants') or {}
+    return bool(name) and variants.get('source') != name
+
+
+def variant_fields(field_name, width, height, variants):
+    return {
+        f'{field_name}_width': width,
+        f'{field_name}_height': height,
+        f'{field_name}_variants': variants,
+    }
+
+
+def generate_image_variants(instance, field_name):
+    """Builds the variants of instance's image and stores them with a plain UPDATE."""
+    field_file = getattr(instance, field_name)
+    try:
+        values = variant_fields(field_name, *build_variants(field_file.storage, field_file.name))
+    except Exception:
+        logger.warning('Could not build variants for %s', field_file.name, exc_info=True)
+        return
+    type(instance)._default_manager.filter(pk=instance.pk).update(**values)
+    for attname, value in values.items():
+        setattr(instance, attname, value)
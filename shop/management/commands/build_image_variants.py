@@ -0,0 +1,67 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from shop.images import IMAGE_FIELDS, build_field_variants, variant_fields
+
+
+class Command(BaseCommand):
+    help = 'Build responsive WebP/JPEG variants for product, gallery and category images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes (defaults to the CPU count)')
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Number of rows saved per UPDATE batch')
+        parser.add_argument('--force', action='store_true',
+                            help='Rebuild variants that are already up to date')
+
+    def pending(self, model, field_name, force):
+        rows = model._default_manager.exclude(**{field_name: ''}).order_by('pk').values_list(
+            'pk', field_name, f'{field_name}_variants'
+        )
+        for pk, name, variants in rows.iterator():
+            if force or (variants or {}).get('source') != name:
+                yield pk, name
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        built = failed = 0
+
+        # Worker processes must not share the parent's database connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as executor:
+            for model_label, field_name in IMAGE_FIELDS:
+                model = apps.get_model(model_label)
+                fields = list(variant_fields(field_name, None, None, None))
+                futures = {
+                    executor.submit(build_field_variants, model_label, field_name, name): pk
+                    for pk, name in self.pending(model, field_name, options['force'])
+                }
+                batch = []
+                for future in as_completed(futures):
+                    try:
+                        values = variant_fields(field_name, *future.result())
+                    except Exception as error:
+                        # Unreadable, truncated or oversized (DecompressionBombError) files
+                        failed += 1
+                        self.stderr.write(f"{model_label} {futures[future]}: {type(error).__name__}: {error}")
+                        continue
+                    batch.append(model(pk=futures[future], **values))
+                    if len(batch) >= options['batch_size']:
+                        model._default_manager.bulk_update(batch, fields)
+                        built += len(batch)
+                        batch = []
+                if batch:
+                    model._default_manager.bulk_update(batch, fields)
+                    built += len(batch)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Built variants for {built} images in {elapsed:.1f}s ({failed} failed)."
+        ))
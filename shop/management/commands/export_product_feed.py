@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from shop.feeds import CHUNK_SIZE, FEED_FORMATS, product_feed
+
+
+class Command(BaseCommand):
+    help = 'Write the product feed for marketplaces as CSV, JSON Lines or XML'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FEED_FORMATS), default='csv',
+                            help='Feed format')
+        parser.add_argument('--output', default='-',
+                            help="File to write, '-' for stdout")
+        parser.add_argument('--base-url', required=True,
+                            help='Site URL the product and image links start with, e.g. https://shop.example')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Number of products read per query')
+
+    def handle(self, *args, **options):
+        feed = product_feed(options['format'], options['base_url'], options['chunk_size'])
+        if options['output'] == '-':
+            for chunk in feed:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            output.writelines(feed)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}."))
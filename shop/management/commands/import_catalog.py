@@ -0,0 +1,322 @@
+import csv
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.text import slugify
+
+from shop.context_processors import invalidate_categories
+from shop.facets import refresh_product_facets
+from shop.models import Category, Product, ProductGallery, Variation
+from shop.page_cache import LISTINGS_TAG, NAV_TAG, invalidate_tags
+from shop.search import index_products
+
+
+PRODUCT_FIELDS = (
+    'product_name', 'price', 'stock', 'is_available', 'short_description',
+    'product_content', 'product_image', 'seo_description', 'seo_keywords',
+)
+# List columns: '|'-separated in CSV (colors and sizes also take commas), arrays in JSONL
+LIST_FIELDS = ('categories', 'colors', 'sizes', 'gallery')
+VARIATION_FIELDS = (('colors', 'color'), ('sizes', 'size'))
+
+
+def parse_list(value, separators='|'):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        for separator in separators[1:]:
+            value = value.replace(separator, separators[0])
+        value = value.split(separators[0])
+    return list(dict.fromkeys(str(item).strip() for item in value if str(item).strip()))
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+class Command(BaseCommand):
+    help = 'Import categories, products, variations and gallery images from a CSV or JSON Lines feed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file, '-' for stdin")
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Feed format (defaults to the file extension)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of products upserted per transaction')
+
+    def read_records(self, file, feed_format):
+        """Yields (line number, record), bad JSON lines are rejected and reported."""
+        if feed_format == 'csv':
+            reader = csv.DictReader(file)
+            for record in reader:
+                yield reader.line_num, record
+            return
+        for line_number, line in enumerate(file, 1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError as error:
+                    self.reject(line_number, error)
+
+    def reject(self, line_number, error):
+        self.stats['rejected'] += 1
+        self.stderr.write(f"Line {line_number}: {error}")
+
+    def clean(self, record):
+        """The record as model values, None when it has no slug, ValueError when a value is unusable."""
+        if not isinstance(record, dict):
+            raise ValueError('not an object')
+        record = {key.strip(): value for key, value in record.items() if key}
+        slug = (record.get('slug') or '').strip() or slugify(record.get('product_name', ''))
+        if not slug:
+            return None
+        product = {'slug': slug}
+        for field in PRODUCT_FIELDS:
+            if field in record and record[field] is not None:
+                value = record[field]
+                if field in ('price', 'stock'):
+                    try:
+                        value = int(float(value or 0))
+                    except (TypeError, ValueError, OverflowError):
+                        raise ValueError(f"{field} {value!r} is not a number")
+                elif field == 'is_available':
+                    value = parse_bool(value)
+                product[field] = value
+        for field in LIST_FIELDS:
+            if field in record:
+                product[field] = parse_list(record[field], '|,' if field in ('colors', 'sizes') else '|')
+        return product
+
+    def handle(self, *args, **options):
+        path = options['path']
+        feed_format = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        batch_size = options['batch_size']
+
+        self.started = time.monotonic()
+        # Category pk by slugify(name), existing categories are found by slug and by name
+        self.categories = {}
+        self.remember_categories(Category.objects.all())
+        self.stats = dict.fromkeys(
+            ('products_created', 'products_updated', 'categories_created', 'memberships',
+             'variations_created', 'variations_deactivated', 'gallery_created', 'gallery_deleted',
+             'skipped', 'rejected'),
+            0,
+        )
+
+        file = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        try:
+            batch = {}
+            for line_number, record in self.read_records(file, feed_format):
+                try:
+                    product = self.clean(record)
+                except ValueError as error:
+                    self.reject(line_number, error)
+                    continue
+                if product is None:
+                    self.stats['skipped'] += 1
+                    continue
+                # A slug repeated within a batch keeps its last record
+                batch[product['slug']] = (line_number, product)
+                if len(batch) >= batch_size:
+                    self.import_or_reject(list(batch.values()))
+                    batch = {}
+            if batch:
+                self.import_or_reject(list(batch.values()))
+        finally:
+            if file is not sys.stdin:
+                file.close()
+            # Every cached page carries NAV_TAG, so this also covers the imported products' pages
+            invalidate_categories()
+            invalidate_tags(NAV_TAG, LISTINGS_TAG)
+
+        imported = self.stats['products_created'] + self.stats['products_updated']
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {imported} products in {elapsed:.1f}s ({imported / max(elapsed, 0.001):.0f}/s)."
+        ))
+        for name, value in self.stats.items():
+            self.stdout.write(f"  {name.replace('_', ' ')}: {value}")
+        self.stdout.write("Run build_image_variants to create responsive variants for new images.")
+
+    def import_or_reject(self, entries):
+        """
+        Imports [(line number, record)] in one transaction. When the database refuses
+        the batch, its records are retried one by one to reject only the bad lines.
+        """
+        if self.try_import([record for _, record in entries]) is None:
+            return
+        for line_number, record in entries:
+            error = self.try_import([record])
+            if error is not None:
+                self.reject(line_number, error)
+
+    def try_import(self, records):
+        """import_batch(), returning the DatabaseError that rolled it back, if any."""
+        stats, categories = dict(self.stats), dict(self.categories)
+        try:
+            self.import_batch(records)
+        except DatabaseError as error:
+            # Whatever the batch counted or learned was rolled back with it
+            self.stats, self.categories = stats, categories
+            return error
+        return None
+
+    def import_batch(self, records):
+        with transaction.atomic():
+            self.upsert_categories(records)
+            products = self.upsert_products(records)
+            self.sync_memberships(records, products)
+            self.sync_variations(records, products)
+            self.sync_gallery(records, products)
+
+            # Bulk writes skip the model signals, refresh the derived data here
+            product_ids = list(products.values())
+            Product.objects.refresh_primary_category(product_ids)
+            refresh_product_facets(product_ids)
+            index_products(Product.objects.filter(pk__in=product_ids).only(
+                'pk', 'product_name', 'short_description', 'product_content', 'is_available'
+            ))
+
+        imported = self.stats['products_created'] + self.stats['products_updated']
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(f"{imported} products ({imported / max(elapsed, 0.001):.0f}/s)")
+
+    def remember_categories(self, categories):
+        for pk, slug, name in categories.values_list('pk', 'slug', 'category_name'):
+            self.categories[slug] = pk
+            self.categories.setdefault(slugify(name), pk)
+
+    def upsert_categories(self, records):
+        names = {}
+        for record in records:
+            for name in record.get('categories') or ():
+                names.setdefault(slugify(name), name)
+        missing = {slug: name for slug, name in names.items() if slug and slug not in self.categories}
+        if not missing:
+            return
+        matching = Q(slug__in=missing) | Q(category_name__in=missing.values())
+        known = set(self.categories.values())
+        Category.objects.bulk_create(
+            [Category(category_name=name, slug=slug) for slug, name in missing.items()],
+            ignore_conflicts=True,
+        )
+        # Conflicting rows (same name or slug) were skipped, pick up whatever now matches
+        found = Category.objects.filter(matching)
+        self.remember_categories(found)
+        self.stats['categories_created'] += len(set(found.values_list('pk', flat=True)) - known)
+
+    def upsert_products(self, records):
+        """Creates or updates the batch's products, returns {slug: pk}."""
+        existing = Product.objects.in_bulk([record['slug'] for record in records], field_name='slug')
+        now = timezone.now()
+        created, updated, update_fields = [], [], {'modified_date'}
+        for record in records:
+            values = {field: record[field] for field in PRODUCT_FIELDS if field in record}
+            product = existing.get(record['slug'])
+            if product is None:
+                values.setdefault('product_name', record['slug'])
+                values.setdefault('price', 0)
+                values.setdefault('stock', 0)
+                created.append(Product(slug=record['slug'], **values))
+                continue
+            for field, value in values.items():
+                setattr(product, field, value)
+            product.modified_date = now
+            update_fields.update(values)
+            updated.append(product)
+
+        Product.objects.bulk_create(created, batch_size=len(records))
+        if updated:
+            Product.objects.bulk_update(updated, sorted(update_fields), batch_size=len(records))
+        self.stats['products_created'] += len(created)
+        self.stats['products_updated'] += len(updated)
+        return dict(Product.objects.filter(slug__in=[record['slug'] for record in records]).values_list('slug', 'pk'))
+
+    def sync_memberships(self, records, products):
+        Membership = Product.category.through
+        wanted = set()
+        for record in records:
+            for name in record.get('categories') or ():
+                category_id = self.categories.get(slugify(name))
+                if category_id is None:
+                    if slugify(name):
+                        self.stderr.write(f"{record['slug']}: category {name!r} could not be created")
+                    continue
+                wanted.add((products[record['slug']], category_id))
+        listed = [products[record['slug']] for record in records if record.get('categories') is not None]
+        current = {
+            (product_id, category_id): pk
+            for pk, product_id, category_id in Membership.objects.filter(product_id__in=listed).values_list(
+                'pk', 'product_id', 'category_id'
+            )
+        }
+        stale = [pk for pair, pk in current.items() if pair not in wanted]
+        if stale:
+            Membership.objects.filter(pk__in=stale).delete()
+        Membership.objects.bulk_create(
+            [Membership(product_id=product_id, category_id=category_id)
+             for product_id, category_id in wanted if (product_id, category_id) not in current],
+            ignore_conflicts=True,
+        )
+        self.stats['memberships'] += len(wanted)
+
+    def sync_variations(self, records, products):
+        wanted = set()
+        listed = {}
+        for record in records:
+            for field, category in VARIATION_FIELDS:
+                if record.get(field) is not None:
+                    product_id = products[record['slug']]
+                    listed.setdefault(category, []).append(product_id)
+                    wanted.update((product_id, category, value) for value in record[field])
+        if not listed:
+            return
+
+        current = {}
+        for category, product_ids in listed.items():
+            variations = Variation.objects.filter(product_id__in=product_ids, variation_category=category)
+            for pk, product_id, value, is_active in variations.values_list(
+                'pk', 'product_id', 'variation_value', 'is_active'
+            ):
+                current[(product_id, category, value)] = (pk, is_active)
+
+        deactivate = [pk for key, (pk, is_active) in current.items() if key not in wanted and is_active]
+        reactivate = [pk for key, (pk, is_active) in current.items() if key in wanted and not is_active]
+        if deactivate:
+            Variation.objects.filter(pk__in=deactivate).update(is_active=False)
+        if reactivate:
+            Variation.objects.filter(pk__in=reactivate).update(is_active=True)
+        new = [
+            Variation(product_id=product_id, variation_category=category, variation_value=value)
+            for product_id, category, value in wanted if (product_id, category, value) not in current
+        ]
+        # bulk_create bypasses Variation.save's comma splitting, values are split in clean()
+        Variation.objects.bulk_create(new)
+        self.stats['variations_created'] += len(new)
+        self.stats['variations_deactivated'] += len(deactivate)
+
+    def sync_gallery(self, records, products):
+        listed = {products[record['slug']]: record['gallery'] for record in records if record.get('gallery') is not None}
+        if not listed:
+            return
+        current = {
+            (product_id, name): pk
+            for pk, product_id, name in ProductGallery.objects.filter(product_id__in=listed).values_list(
+                'pk', 'product_id', 'images'
+            )
+        }
+        wanted = {(product_id, name) for product_id, names in listed.items() for name in names}
+        stale = [pk for key, pk in current.items() if key not in wanted]
+        if stale:
+            ProductGallery.objects.filter(pk__in=stale).delete()
+        new = [ProductGallery(product_id=product_id, images=name) for product_id, name in wanted if (product_id, name) not in current]
+        ProductGallery.objects.bulk_create(new)
+        self.stats['gallery_created'] += len(new)
+        self.stats['gallery_deleted'] += len(stale)
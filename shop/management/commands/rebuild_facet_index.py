@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from shop.facets import refresh_product_facets
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the precomputed store facet index for every product'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of products refreshed per batch')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        product_ids = Product.objects.order_by('pk').values_list('pk', flat=True)
+
+        refreshed = 0
+        batch = []
+        for product_id in product_ids.iterator(chunk_size=batch_size):
+            batch.append(product_id)
+            if len(batch) >= batch_size:
+                refresh_product_facets(batch)
+                refreshed += len(batch)
+                batch = []
+        if batch:
+            refresh_product_facets(batch)
+            refreshed += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Refreshed facets for {refreshed} products."))
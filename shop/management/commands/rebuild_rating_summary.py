@@ -0,0 +1,71 @@
+import math
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from shop.facets import refresh_product_facets
+from shop.models import RATING_STARS, Product, ReviewRating, rating_bucket_filter
+from shop.page_cache import LISTINGS_TAG, invalidate_tags, product_tag
+
+
+SUMMARY_FIELDS = ['review_count', 'rating_total', 'avg_rating'] + [
+    f'rating_{star}_count' for star in RATING_STARS
+]
+
+
+class Command(BaseCommand):
+    help = 'Backfill or repair the denormalized rating summary on Product from approved reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', action='append', dest='slugs', default=[],
+                            help='Only rebuild the product with this slug (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of products written per UPDATE batch')
+
+    def handle(self, *args, **options):
+        reviews = ReviewRating.objects.filter(status=True)
+        products = Product.objects.only(*SUMMARY_FIELDS).order_by('pk')
+        if options['slugs']:
+            reviews = reviews.filter(product__slug__in=options['slugs'])
+            products = products.filter(slug__in=options['slugs'])
+
+        # One grouped query for every product's count, sum and per-star histogram
+        stats = {
+            row.pop('product_id'): row
+            for row in reviews.order_by().values('product_id').annotate(
+                review_count=Count('id'),
+                rating_total=Sum('rating'),
+                **{
+                    f'rating_{star}_count': Count('id', filter=rating_bucket_filter(star))
+                    for star in RATING_STARS
+                },
+            )
+        }
+
+        checked = 0
+        repaired = []
+        for product in products.iterator(chunk_size=options['batch_size']):
+            checked += 1
+            expected = stats.get(product.pk, {})
+            expected = {field: expected.get(field) or 0 for field in SUMMARY_FIELDS}
+            if expected['review_count']:
+                expected['avg_rating'] = expected['rating_total'] / expected['review_count']
+
+            # Float sums and averages are compared with a tolerance, not to the last bit
+            if any(not math.isclose(getattr(product, field), value) for field, value in expected.items()):
+                for field, value in expected.items():
+                    setattr(product, field, value)
+                repaired.append(product)
+
+        with transaction.atomic():
+            Product.objects.bulk_update(repaired, SUMMARY_FIELDS, batch_size=options['batch_size'])
+            # bulk_update skips the Product signals, refresh the rating facets and pages here
+            repaired_ids = [product.pk for product in repaired]
+            if repaired_ids:
+                refresh_product_facets(repaired_ids)
+                invalidate_tags(*[product_tag(pk) for pk in repaired_ids], LISTINGS_TAG)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Checked {checked} products, repaired {len(repaired)} rating summaries.")
+        )
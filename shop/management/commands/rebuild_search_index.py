@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.models import Product
+from shop.search import get_backend, index_products
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text product search index from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of products indexed per batch')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        products = Product.objects.filter(is_available=True).only(
+            'pk', 'product_name', 'short_description', 'product_content', 'is_available'
+        ).order_by('pk')
+
+        indexed = 0
+        with transaction.atomic():
+            get_backend().clear()
+            batch = []
+            for product in products.iterator(chunk_size=batch_size):
+                batch.append(product)
+                if len(batch) >= batch_size:
+                    index_products(batch)
+                    indexed += len(batch)
+                    batch = []
+            if batch:
+                index_products(batch)
+                indexed += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} products."))
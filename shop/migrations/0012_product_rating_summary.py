@@ -0,0 +1,85 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:04
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_rating_summary(apps, schema_editor):
+    """Summarizes the approved reviews of every product, like the rebuild_rating_summary command."""
+    Product = apps.get_model('shop', 'Product')
+    ReviewRating = apps.get_model('shop', 'ReviewRating')
+
+    # Histogram buckets of shop.models.rating_bucket: 4.5 counts as a 4
+    buckets = {
+        1: Q(rating__lt=2),
+        2: Q(rating__gte=2, rating__lt=3),
+        3: Q(rating__gte=3, rating__lt=4),
+        4: Q(rating__gte=4, rating__lt=5),
+        5: Q(rating__gte=5),
+    }
+    stats = ReviewRating.objects.filter(status=True).order_by().values('product_id').annotate(
+        review_count=Count('id'),
+        rating_total=Sum('rating'),
+        **{f'rating_{star}_count': Count('id', filter=bucket) for star, bucket in buckets.items()},
+    )
+    products = []
+    for row in stats:
+        product = Product(pk=row.pop('product_id'), **row)
+        product.avg_rating = product.rating_total / product.review_count
+        products.append(product)
+    Product.objects.bulk_update(
+        products,
+        ['review_count', 'rating_total', 'avg_rating'] + [f'rating_{star}_count' for star in buckets],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_alter_productgallery_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='avg_rating',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_total',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_rating_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+def backfill_primary_category_slug(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    Membership = Product.category.through
+
+    primary = {}
+    memberships = Membership.objects.order_by('product_id', 'category__category_name').values_list(
+        'product_id', 'category__slug'
+    )
+    for product_id, slug in memberships.iterator():
+        primary.setdefault(product_id, slug)
+
+    products = []
+    for product in Product.objects.filter(pk__in=primary).only('pk').iterator():
+        product.primary_category_slug = primary[product.pk]
+        products.append(product)
+    Product.objects.bulk_update(products, ['primary_category_slug'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_product_rating_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='primary_category_slug',
+            field=models.SlugField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.RunPython(backfill_primary_category_slug, migrations.RunPython.noop),
+    ]
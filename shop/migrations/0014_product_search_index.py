@@ -0,0 +1,82 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:20
+
+import html
+
+from django.db import migrations
+from django.utils.html import strip_tags
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE shop_product_fts USING fts5("
+            "product_name, short_description, content, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+        # Default ORDER BY rank: bm25 weighting name over summary over body
+        schema_editor.execute(
+            "INSERT INTO shop_product_fts (shop_product_fts, rank) VALUES ('rank', 'bm25(10.0, 4.0, 1.0)')"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE TABLE shop_product_search ("
+            "product_id bigint PRIMARY KEY REFERENCES shop_product (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            "CREATE INDEX shop_product_search_document_idx ON shop_product_search USING GIN (document)"
+        )
+
+
+def backfill_search_index(apps, schema_editor):
+    """Indexes the available products, like shop.search.index_products."""
+    Product = apps.get_model('shop', 'Product')
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        sql = (
+            "INSERT INTO shop_product_fts (rowid, product_name, short_description, content) "
+            "VALUES (%s, %s, %s, %s)"
+        )
+    elif vendor == 'postgresql':
+        sql = (
+            "INSERT INTO shop_product_search (product_id, document) "
+            "VALUES (%s, setweight(to_tsvector('english', %s), 'A') "
+            "|| setweight(to_tsvector('english', %s), 'B') "
+            "|| setweight(to_tsvector('english', %s), 'C'))"
+        )
+    else:
+        return
+
+    products = Product.objects.filter(is_available=True).values_list(
+        'pk', 'product_name', 'short_description', 'product_content'
+    ).order_by('pk')
+    rows = []
+    with schema_editor.connection.cursor() as cursor:
+        for pk, name, summary, content in products.iterator(chunk_size=500):
+            rows.append((pk, name, summary, ' '.join(html.unescape(strip_tags(content or '')).split())))
+            if len(rows) >= 500:
+                cursor.executemany(sql, rows)
+                rows = []
+        if rows:
+            cursor.executemany(sql, rows)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS shop_product_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP TABLE IF EXISTS shop_product_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_product_primary_category_slug'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(backfill_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+PRICE_BANDS = (
+    ('0-50', 0, 50, '$0 - $50'),
+    ('50-100', 50, 100, '$50 - $100'),
+    ('100-200', 100, 200, '$100 - $200'),
+    ('200-500', 200, 500, '$200 - $500'),
+    ('500-1000', 500, 1000, '$500 - $1000'),
+    ('1000+', 1000, None, '$1000+'),
+)
+
+
+def backfill_facets(apps, schema_editor):
+    """Same rows as shop.facets.refresh_product_facets, for every available product."""
+    Product = apps.get_model('shop', 'Product')
+    ProductFacet = apps.get_model('shop', 'ProductFacet')
+    Variation = apps.get_model('shop', 'Variation')
+
+    rows = {}
+    products = Product.objects.filter(is_available=True).only('pk', 'price', 'stock', 'avg_rating', 'review_count')
+    for product in products.iterator():
+        facets = rows.setdefault(product.pk, {})
+        for value, low, high, label in PRICE_BANDS:
+            if product.price >= low and (high is None or product.price < high):
+                facets[('price', value)] = label
+                break
+        else:
+            facets[('price', PRICE_BANDS[0][0])] = PRICE_BANDS[0][3]
+        if product.stock > 0:
+            facets[('availability', 'in_stock')] = 'In Stock'
+        else:
+            facets[('availability', 'out_of_stock')] = 'Out of Stock'
+        if product.review_count:
+            for threshold in (4, 3, 2, 1):
+                if product.avg_rating >= threshold:
+                    facets[('rating', str(threshold))] = f'{threshold} stars & up'
+
+    memberships = Product.category.through.objects.values_list(
+        'product_id', 'category__slug', 'category__category_name'
+    )
+    for product_id, slug, name in memberships.iterator():
+        if product_id in rows:
+            rows[product_id][('category', slug)] = name
+    variations = Variation.objects.filter(is_active=True).values_list(
+        'product_id', 'variation_category', 'variation_value'
+    )
+    for product_id, category, value in variations.iterator():
+        if product_id in rows:
+            rows[product_id][(category, value.strip().lower())] = value.strip()
+
+    ProductFacet.objects.bulk_create([
+        ProductFacet(product_id=product_id, facet=facet, value=value, label=label)
+        for product_id, facets in rows.items()
+        for (facet, value), label in facets.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0015_product_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(max_length=20)),
+                ('value', models.CharField(max_length=100)),
+                ('label', models.CharField(max_length=100)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='shop.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['facet', 'value', 'product'], name='facet_value_product_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'facet', 'value'), name='unique_product_facet_value')],
+            },
+        ),
+        migrations.RunPython(backfill_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='variation',
+            index=models.Index(fields=['product', 'variation_category', 'variation_value'], name='variation_lookup_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_variation_lookup_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gmailtoken',
+            name='refresh_claimed_until',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
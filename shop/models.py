@@ -1,5 +1,6 @@
 from django.conf import settings
 from django.db import models
+from django.db.models import Q
 from django.urls import reverse
 from tinymce.models import HTMLField
 
@@ -11,6 +12,10 @@ class Category(models.Model):
     order = models.IntegerField(default=0)
     description = HTMLField(blank=True)
     category_image = models.ImageField(upload_to='categories', blank=True)
+    # Original size and responsive variants, maintained by shop.images
+    category_image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    category_image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    category_image_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     class Meta:
         verbose_name_plural = 'Categories'
@@ -21,16 +26,67 @@ class Category(models.Model):
 
     def __str__(self):
         return self.category_name
-    
+
+
+class ProductManager(models.Manager):
+    def _primary_category_slugs(self, product_ids):
+        primary = {}
+        memberships = Product.category.through.objects.filter(
+            product_id__in=product_ids
+        ).order_by('product_id', 'category__category_name').values_list('product_id', 'category__slug')
+        for product_id, slug in memberships:
+            primary.setdefault(product_id, slug)
+        return primary
+
+    def refresh_primary_category(self, product_ids):
+        """
+        Recomputes primary_category_slug for the given products in two queries.
+        The primary category is the first one by name, matching Category.Meta.ordering.
+        """
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        primary = self._primary_category_slugs(product_ids)
+
+        changed = []
+        for product in self.filter(pk__in=product_ids).only('pk', 'primary_category_slug'):
+            slug = primary.get(product.pk, '')
+            if product.primary_category_slug != slug:
+                product.primary_category_slug = slug
+                changed.append(product)
+        self.bulk_update(changed, ['primary_category_slug'], batch_size=500)
+
+    def resolve_urls(self, products):
+        """
+        Resolves get_url() for a whole page of products up front.
+        Products missing a primary category slug are looked up in one query.
+        """
+        products = list(products)
+        missing = [product.pk for product in products if not product.primary_category_slug]
+        if missing:
+            primary = self._primary_category_slugs(missing)
+            for product in products:
+                if not product.primary_category_slug:
+                    product.primary_category_slug = primary.get(product.pk, '')
+        for product in products:
+            product._url = product.get_url()
+        return products
+
 
 class Product(models.Model):
     product_name = models.CharField(max_length=200)
     slug = models.SlugField(max_length=200, unique=True)
     category = models.ManyToManyField(Category, related_name='products')
+    # Slug of the first category by name, kept in sync by shop.signals
+    primary_category_slug = models.SlugField(max_length=100, blank=True, editable=False)
     price = models.IntegerField()
     product_content = HTMLField(blank=True)
     short_description = models.TextField(blank=True)
     product_image = models.ImageField(upload_to='products', blank=True)
+    # Original size and responsive variants, maintained by shop.images
+    product_image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    product_image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    product_image_variants = models.JSONField(default=dict, blank=True, editable=False)
     stock = models.IntegerField()
     is_available = models.BooleanField(default=True)
     created_date = models.DateTimeField(auto_now_add=True)
@@ -38,15 +94,39 @@ class Product(models.Model):
     seo_description = models.TextField(max_length=200, blank=True)
     seo_keywords = models.CharField(max_length=255, blank=True)
 
+    # Rating summary, maintained by shop.signals from approved reviews
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_total = models.FloatField(default=0, editable=False)
+    avg_rating = models.FloatField(default=0, editable=False)
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = ProductManager()
+
     class Meta:
         ordering = ['product_name']
+        # Keyset pagination sort keys (shop.pagination.SORT_KEYS)
+        indexes = [
+            models.Index(fields=['is_available', 'product_name', 'id'], name='product_avail_name_idx'),
+            models.Index(fields=['is_available', 'created_date', 'id'], name='product_avail_created_idx'),
+            models.Index(fields=['is_available', 'price', 'id'], name='product_avail_price_idx'),
+        ]
 
     def get_url(self):
-        first_category = self.category.first()
-        if first_category:
-            return reverse('product_detail', args=[first_category.slug, self.slug])
+        url = self.__dict__.get('_url')
+        if url is not None:
+            return url
+        if self.primary_category_slug:
+            return reverse('product_detail', args=[self.primary_category_slug, self.slug])
         return '#' 
 
+    def rating_distribution(self):
+        """Number of approved reviews per star, highest first."""
+        return {star: getattr(self, f'rating_{star}_count') for star in RATING_STARS}
+
     def __str__(self):
         return self.product_name
     
@@ -71,6 +151,12 @@ class Variation(models.Model):
 
     objects = VariationManager()
 
+    class Meta:
+        # Variation lookups when adding to cart and importing
+        indexes = [
+            models.Index(fields=['product', 'variation_category', 'variation_value'], name='variation_lookup_idx'),
+        ]
+
     def save(self, *args, **kwargs):
     # Check if comma exists in variation_value
         if ',' in self.variation_value:
@@ -98,9 +184,25 @@ class GmailToken(models.Model):
     access_token = models.TextField()
     refresh_token = models.TextField()
     token_expiry = models.DateTimeField()
+    # Set by the worker refreshing the token with Google, see utils.generate_credentials
+    refresh_claimed_until = models.DateTimeField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+RATING_STARS = (5, 4, 3, 2, 1)
+
+def rating_bucket(rating):
+    """Star a rating is counted under in the histogram (4.5 counts as a 4)."""
+    return min(5, max(1, int(rating)))
+
+def rating_bucket_filter(star):
+    """Q object matching the ratings that rating_bucket() puts under star."""
+    if star == 5:
+        return Q(rating__gte=5)
+    if star == 1:
+        return Q(rating__lt=2)
+    return Q(rating__gte=star, rating__lt=star + 1)
+
 class ReviewRating(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     user = models.ForeignKey(Account, on_delete=models.CASCADE)
@@ -115,9 +217,36 @@ class ReviewRating(models.Model):
     def __str__(self):
         return self.subject
     
+class ProductFacet(models.Model):
+    """Precomputed facet values of an available product, maintained by shop.facets."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='facets')
+    facet = models.CharField(max_length=20)
+    value = models.CharField(max_length=100)
+    label = models.CharField(max_length=100)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'facet', 'value'], name='unique_product_facet_value'),
+        ]
+        indexes = [
+            models.Index(fields=['facet', 'value', 'product'], name='facet_value_product_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.facet}={self.value}"
+
+class FacetChange(models.Model):
+    """Products whose facet rows changed, read by every process to catch up its FacetIndex."""
+    product_ids = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
 class ProductGallery(models.Model):
     product = models.ForeignKey(Product, default=None, on_delete=models.CASCADE, related_name='images')
     images = models.ImageField(upload_to='products/product_gallery', blank=True, max_length=255)
+    # Original size and responsive variants, maintained by shop.images
+    images_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    images_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    images_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return self.product.product_name
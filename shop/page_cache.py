@@ -0,0 +1,156 @@
+"""
+Full-page cache for anonymous catalog pages.
+
+Pages are keyed on path + sorted query string and stored together with the
+versions of the tags they were built from ('catalog:nav', 'catalog:listings',
+'product:<id>'). Signals rotate a tag's version when the underlying rows
+change, which makes every page built from it stale without having to know
+which URLs those were.
+
+Only one worker rebuilds a stale page (cache.add lock); the others keep
+serving the stale copy, or wait briefly for the first fill when there is none.
+The per-visitor parts (CSRF token, cart badge) are rendered as placeholders by
+the page_cache_placeholders context processor and filled in on every hit.
+"""
+import hashlib
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+NAV_TAG = 'catalog:nav'
+LISTINGS_TAG = 'catalog:listings'
+
+CSRF_PLACEHOLDER = 'PAGECACHECSRFTOKEN'
+CART_COUNT_PLACEHOLDER = 'PAGECACHECARTCOUNT'
+
+PAGE_KEY = 'shop:page:%s'
+LOCK_KEY = 'shop:page-lock:%s'
+TAG_KEY = 'shop:page-tag:%s'
+
+LOCK_TIMEOUT = 30
+WAIT_TIMEOUT = 5
+WAIT_INTERVAL = 0.05
+
+
+def product_tag(product_id):
+    return f'product:{product_id}'
+
+
+def _tag_versions(tags):
+    keys = {TAG_KEY % tag: tag for tag in tags}
+    versions = cache.get_many(keys)
+    for key, tag in keys.items():
+        if key not in versions:
+            # A version that was never set or got evicted invalidates its pages
+            cache.add(key, uuid.uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def invalidate_tags(*tags):
+    """Rotates the tag versions once the current transaction commits."""
+    def rotate():
+        cache.set_many({TAG_KEY % tag: uuid.uuid4().hex for tag in tags}, None)
+    transaction.on_commit(rotate)
+
+
+def add_page_cache_tags(request, *tags):
+    """Lets a view declare which rows the page it renders depends on."""
+    request.page_cache_tags = getattr(request, 'page_cache_tags', set()) | set(tags)
+
+
+def _page_key(request):
+    query = '&'.join(sorted(request.GET.urlencode().split('&')))
+    return hashlib.md5(f'{request.path}?{query}'.encode()).hexdigest()
+
+
+def _is_cacheable(request):
+    return (
+        getattr(settings, 'SHOP_PAGE_CACHE', True)
+        and request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+        # Pending flash messages are rendered the normal way and consumed
+        and 'messages' not in request.COOKIES
+    )
+
+
+def _fill_placeholders(request, content):
+    """Puts this visitor's CSRF token and cart count in place of the placeholders."""
+    if CSRF_PLACEHOLDER.encode() in content:
+        content = content.replace(CSRF_PLACEHOLDER.encode(), get_token(request).encode())
+    if CART_COUNT_PLACEHOLDER.encode() in content:
+        from carts.context_processors import cart_count
+        content = content.replace(CART_COUNT_PLACEHOLDER.encode(), str(cart_count(request)).encode())
+    return content
+
+
+def _fill_in(request, entry):
+    content = _fill_placeholders(request, entry['content'])
+    response = HttpResponse(content, content_type=entry['content_type'])
+    response['X-Page-Cache'] = entry.get('status', 'hit')
+    return response
+
+
+def _is_fresh(entry):
+    return entry['versions'] == _tag_versions(entry['versions'])
+
+
+def cache_anonymous_page(*tags):
+    """
+    Caches the view's response for anonymous visitors. tags apply to every
+    page of the view; the view can add more with add_page_cache_tags().
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _is_cacheable(request):
+                return view(request, *args, **kwargs)
+
+            key = _page_key(request)
+            entry = cache.get(PAGE_KEY % key)
+            if entry is not None and _is_fresh(entry):
+                return _fill_in(request, entry)
+
+            if not cache.add(LOCK_KEY % key, 1, LOCK_TIMEOUT):
+                # Someone else is rebuilding this page
+                if entry is not None:
+                    return _fill_in(request, dict(entry, status='stale'))
+                deadline = time.monotonic() + WAIT_TIMEOUT
+                while time.monotonic() < deadline:
+                    time.sleep(WAIT_INTERVAL)
+                    entry = cache.get(PAGE_KEY % key)
+                    if entry is not None:
+                        return _fill_in(request, entry)
+                return view(request, *args, **kwargs)
+
+            try:
+                # Read versions before rendering so a change mid-render leaves it stale
+                request.page_cache_tags = {NAV_TAG, *tags}
+                request.page_cache_fill = True
+                versions = _tag_versions(request.page_cache_tags)
+                response = view(request, *args, **kwargs)
+                request.page_cache_fill = False
+
+                if response.status_code != 200 or response.streaming or response.cookies:
+                    # Not cached, but rendered with placeholders all the same
+                    if not response.streaming:
+                        response.content = _fill_placeholders(request, response.content)
+                    return response
+                versions.update(_tag_versions(request.page_cache_tags - set(versions)))
+                entry = {
+                    'content': response.content,
+                    'content_type': response['Content-Type'],
+                    'versions': versions,
+                }
+                cache.set(PAGE_KEY % key, entry, getattr(settings, 'SHOP_PAGE_CACHE_TIMEOUT', 300))
+                return _fill_in(request, dict(entry, status='miss'))
+            finally:
+                cache.delete(LOCK_KEY % key)
+        return wrapper
+    return decorator
@@ -0,0 +1,184 @@
+"""
+Keyset (cursor) pagination for storefront listings.
+
+Pages are addressed with ?after=<token> / ?before=<token> instead of ?page=N.
+A token is the signed sort key of the last (or first) row shown, so every page
+is an indexed range scan with a LIMIT, however deep the visitor goes. The old
+OFFSET paginator stays available behind SHOP_KEYSET_PAGINATION = False.
+"""
+from django.conf import settings
+from django.core import signing
+from django.core.paginator import Paginator
+from django.db.models import Q, QuerySet
+
+
+SORT_KEYS = {
+    'name': ('product_name', 'id'),
+    'newest': ('-created_date', '-id'),
+    'price_low': ('price', 'id'),
+    'price_high': ('-price', '-id'),
+}
+SORT_CHOICES = (
+    ('name', 'Featured'),
+    ('price_low', 'Price: Low to High'),
+    ('price_high', 'Price: High to Low'),
+    ('newest', 'Newest'),
+)
+DEFAULT_SORT = 'name'
+
+TOKEN_SALT = 'shop.pagination'
+
+
+def get_sort(request):
+    sort = request.GET.get('sort')
+    return sort if sort in SORT_KEYS else DEFAULT_SORT
+
+
+def _json_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def make_token(sort, number, key):
+    return signing.dumps({'s': sort, 'n': number, 'k': [_json_value(v) for v in key]}, salt=TOKEN_SALT)
+
+
+def read_token(token, sort):
+    """Returns (page number, sort key) or None for a missing, forged or stale token."""
+    if not token:
+        return None
+    try:
+        data = signing.loads(token, salt=TOKEN_SALT)
+    except signing.BadSignature:
+        return None
+    if data.get('s') != sort or not isinstance(data.get('k'), list):
+        return None
+    return max(int(data.get('n', 1)), 1), data['k']
+
+
+def keyset_filter(ordering, key, backwards=False):
+    """
+    Q for rows strictly after key in ordering (before it when backwards), e.g.
+    price >= 10 AND (price > 10 OR (price = 10 AND id > 42)).
+    The leading >= keeps it a plain range scan on the (field, id) index.
+    """
+    names = [field.lstrip('-') for field in ordering]
+    condition = Q()
+    for position, name in enumerate(names):
+        descending = ordering[position].startswith('-') != backwards
+        step = Q(**{f'{name}__{"lt" if descending else "gt"}': key[position]})
+        for previous_name, previous_value in zip(names[:position], key[:position]):
+            step &= Q(**{previous_name: previous_value})
+        condition |= step
+    first_descending = ordering[0].startswith('-') != backwards
+    return Q(**{f'{names[0]}__{"lte" if first_descending else "gte"}': key[0]}) & condition
+
+
+class QuerysetFetcher:
+    def __init__(self, queryset, ordering):
+        self.queryset = queryset
+        self.ordering = ordering
+
+    def __call__(self, key, backwards, limit):
+        ordering = self.ordering
+        if backwards:
+            ordering = [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+        products = self.queryset.order_by(*ordering)
+        if key is not None:
+            products = products.filter(keyset_filter(self.ordering, key, backwards))
+        names = [field.lstrip('-') for field in self.ordering]
+        return [(product, [getattr(product, name) for name in names]) for product in products[:limit]]
+
+
+class KeysetPage:
+    """Quacks like django.core.paginator.Page for the store.html templates."""
+
+    is_keyset = True
+
+    def __init__(self, object_list, number, next_token, previous_token):
+        self.object_list = object_list
+        self.number = number
+        self.next_token = next_token
+        self.previous_token = previous_token
+
+    def has_next(self):
+        return self.next_token is not None
+
+    def has_previous(self):
+        return self.previous_token is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+
+def keyset_page(request, fetch, per_page, sort):
+    after = read_token(request.GET.get('after'), sort)
+    before = None if after else read_token(request.GET.get('before'), sort)
+    position = after or before
+    backwards = before is not None
+
+    # One extra row tells whether there is anything beyond this page
+    rows = fetch(position[1] if position else None, backwards, per_page + 1)
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    number = position[0] if position else 1
+    if not rows:
+        return KeysetPage([], number, None, None)
+    has_next = has_more if not backwards else True
+    has_previous = number > 1 and (has_more if backwards else True)
+    return KeysetPage(
+        [product for product, _ in rows],
+        number,
+        make_token(sort, number + 1, rows[-1][1]) if has_next else None,
+        make_token(sort, number - 1, rows[0][1]) if has_previous else None,
+    )
+
+
+def listing_count(products):
+    """
+    Returns (count, is_estimate) per SHOP_LISTING_COUNT:
+    'exact' counts everything, 'estimate' stops counting at SHOP_LISTING_COUNT_LIMIT
+    and reports it as a lower bound, 'off' skips the count entirely.
+    """
+    mode = getattr(settings, 'SHOP_LISTING_COUNT', 'exact')
+    if mode == 'off':
+        return None, False
+    if mode == 'estimate' and isinstance(products, QuerySet):
+        limit = getattr(settings, 'SHOP_LISTING_COUNT_LIMIT', 1000)
+        count = products.order_by()[:limit + 1].count()
+        return min(count, limit), count > limit
+    return products.count(), False
+
+
+def paginate_products(request, products, per_page, sort=None, count=None):
+    """
+    Paginates a Product queryset (in the given sort) or shop.search.SearchResults.
+    A count already known to the caller skips the count query.
+    Returns (page, product_count, product_count_is_estimate).
+    """
+    if isinstance(products, QuerySet):
+        sort = sort or DEFAULT_SORT
+        ordering = SORT_KEYS[sort]
+        products = products.order_by(*ordering)
+        fetch = QuerysetFetcher(products, ordering)
+    else:
+        sort = 'relevance'
+        fetch = products.fetch
+
+    if not getattr(settings, 'SHOP_KEYSET_PAGINATION', True):
+        paginator = Paginator(products, per_page)
+        return paginator.get_page(request.GET.get('page')), paginator.count, False
+
+    page = keyset_page(request, fetch, per_page, sort)
+    if count is not None:
+        return page, count, False
+    count, is_estimate = listing_count(products)
+    return page, count, is_estimate
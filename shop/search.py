@@ -0,0 +1,264 @@
+"""
+Full-text product search.
+
+Only available products are indexed, over their name, short description and
+HTML-stripped content. SQLite uses an FTS5 table ranked with bm25(), PostgreSQL
+a GIN-indexed tsvector table ranked with ts_rank_cd(). Counting and paging
+(offset or keyset on rank) are answered from the index alone; Product rows are
+only loaded for the page shown.
+"""
+import html
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import strip_tags
+
+from shop.models import Product
+from shop.pagination import QuerysetFetcher
+
+
+INDEXED_FIELDS = ('product_name', 'short_description', 'product_content', 'is_available')
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def search_terms(query):
+    """Splits a raw query into plain word terms, dropping any search syntax."""
+    return _TERM_RE.findall((query or '').lower())[:16]
+
+
+def html_to_text(value):
+    return ' '.join(html.unescape(strip_tags(value or '')).split())
+
+
+class SQLiteSearchBackend:
+    table = 'shop_product_fts'
+
+    def match(self, terms):
+        # Quoted prefix terms, ANDed: "red"* "shi"*
+        return ' '.join('"%s"*' % term for term in terms)
+
+    def upsert(self, rows):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, product_name, short_description, content) VALUES (%s, %s, %s, %s)',
+                rows,
+            )
+
+    def delete(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(pk,) for pk in product_ids])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+
+    def count(self, terms):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {self.table} WHERE {self.table} MATCH %s', [self.match(terms)])
+            return cursor.fetchone()[0]
+
+    def page(self, terms, offset, limit):
+        # rank is configured as bm25() with column weights in the migration
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s ORDER BY rank LIMIT %s OFFSET %s',
+                [self.match(terms), limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def keyset(self, terms, key, backwards, limit):
+        # Ascending bm25 rank (best first), rowid breaks ties
+        op, order = ('<', 'DESC') if backwards else ('>', 'ASC')
+        sql = f'SELECT rowid, r FROM (SELECT rowid, rank AS r FROM {self.table} WHERE {self.table} MATCH %s)'
+        params = [self.match(terms)]
+        if key is not None:
+            sql += f' WHERE r {op} %s OR (r = %s AND rowid {op} %s)'
+            params += [key[0], key[0], key[1]]
+        sql += f' ORDER BY r {order}, rowid {order} LIMIT %s'
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params + [limit])
+            return [(pk, [rank, pk]) for pk, rank in cursor.fetchall()]
+
+
+class PostgresSearchBackend:
+    table = 'shop_product_search'
+    config = 'english'
+
+    def match(self, terms):
+        return ' & '.join('%s:*' % term for term in terms)
+
+    def upsert(self, rows):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"""
+                INSERT INTO {self.table} (product_id, document)
+                VALUES (%s, setweight(to_tsvector('{self.config}', %s), 'A')
+                         || setweight(to_tsvector('{self.config}', %s), 'B')
+                         || setweight(to_tsvector('{self.config}', %s), 'C'))
+                ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document
+                """,
+                rows,
+            )
+
+    def delete(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE product_id = ANY(%s)', [list(product_ids)])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {self.table}')
+
+    def count(self, terms):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT COUNT(*) FROM {self.table} WHERE document @@ to_tsquery('{self.config}', %s)",
+                [self.match(terms)],
+            )
+            return cursor.fetchone()[0]
+
+    def page(self, terms, offset, limit):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT product_id FROM {self.table}, to_tsquery('{self.config}', %s) query
+                WHERE document @@ query
+                ORDER BY ts_rank_cd(document, query) DESC, product_id
+                LIMIT %s OFFSET %s
+                """,
+                [self.match(terms), limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def keyset(self, terms, key, backwards, limit):
+        # Descending ts_rank_cd (best first), product_id breaks ties
+        if backwards:
+            condition, order = 'rank > %s OR (rank = %s AND product_id < %s)', 'rank ASC, product_id DESC'
+        else:
+            condition, order = 'rank < %s OR (rank = %s AND product_id > %s)', 'rank DESC, product_id ASC'
+        sql = f"""
+            SELECT product_id, rank FROM (
+                SELECT product_id, ts_rank_cd(document, query) AS rank
+                FROM {self.table}, to_tsquery('{self.config}', %s) query
+                WHERE document @@ query
+            ) ranked
+        """
+        params = [self.match(terms)]
+        if key is not None:
+            sql += f' WHERE {condition}'
+            params += [key[0], key[0], key[1]]
+        sql += f' ORDER BY {order} LIMIT %s'
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params + [limit])
+            return [(pk, [rank, pk]) for pk, rank in cursor.fetchall()]
+
+
+class FallbackSearchBackend:
+    """Unindexed icontains search for databases without a full-text engine."""
+
+    def upsert(self, rows):
+        pass
+
+    def delete(self, product_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def queryset(self, terms):
+        products = Product.objects.filter(is_available=True)
+        for term in terms:
+            products = products.filter(
+                Q(product_name__icontains=term) | Q(short_description__icontains=term) | Q(product_content__icontains=term)
+            )
+        return products.order_by('-created_date')
+
+    def count(self, terms):
+        return self.queryset(terms).count()
+
+    def page(self, terms, offset, limit):
+        return list(self.queryset(terms).values_list('pk', flat=True)[offset:offset + limit])
+
+    def keyset(self, terms, key, backwards, limit):
+        fetch = QuerysetFetcher(self.queryset(terms), ('-created_date', '-id'))
+        return [(product.pk, product_key) for product, product_key in fetch(key, backwards, limit)]
+
+
+def get_backend():
+    if connection.vendor == 'sqlite':
+        return SQLiteSearchBackend()
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return FallbackSearchBackend()
+
+
+def index_products(products):
+    """Adds or refreshes products in the search index, dropping unavailable ones."""
+    backend = get_backend()
+    rows = []
+    removed = []
+    for product in products:
+        if product.is_available:
+            rows.append((
+                product.pk,
+                product.product_name,
+                product.short_description,
+                html_to_text(product.product_content),
+            ))
+        else:
+            removed.append(product.pk)
+    if rows:
+        backend.upsert(rows)
+    if removed:
+        backend.delete(removed)
+
+
+def remove_products(product_ids):
+    product_ids = list(product_ids)
+    if product_ids:
+        get_backend().delete(product_ids)
+
+
+class SearchResults:
+    """
+    Lazy, sliceable search result set, so it can be handed to Paginator.
+    count() and each slice are single queries against the index.
+    """
+
+    def __init__(self, query):
+        self.terms = search_terms(query)
+        self.backend = get_backend()
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = self.backend.count(self.terms) if self.terms else 0
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        offset = index.start or 0
+        limit = (index.stop if index.stop is not None else self.count()) - offset
+        if not self.terms or limit <= 0:
+            return []
+        ids = self.backend.page(self.terms, offset, limit)
+        products = Product.objects.in_bulk(ids)
+        return [products[pk] for pk in ids if pk in products]
+
+    def fetch(self, key, backwards, limit):
+        """Keyset fetch for shop.pagination: (product, sort key) pairs after key."""
+        if not self.terms:
+            return []
+        rows = self.backend.keyset(self.terms, key, backwards, limit)
+        products = Product.objects.in_bulk([pk for pk, _ in rows])
+        return [(products[pk], row_key) for pk, row_key in rows if pk in products]
+
+
+def search_products(query):
+    return SearchResults(query)
@@ -0,0 +1,235 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from shop.context_processors import invalidate_categories
+from shop.facets import refresh_product_facets
+from shop.images import generate_image_variants, needs_variants
+from shop.models import Category, Product, ProductGallery, ReviewRating, Variation, rating_bucket
+from shop.page_cache import LISTINGS_TAG, NAV_TAG, invalidate_tags, product_tag
+from shop.search import INDEXED_FIELDS, index_products, remove_products
+
+
+def apply_rating_changes(product_id, changes):
+    """
+    Applies (rating, +1/-1) changes to a product's rating summary in one UPDATE.
+    Uses F() expressions so concurrent reviews don't overwrite each other.
+    """
+    count_delta = sum(sign for _, sign in changes)
+    total_delta = sum(rating * sign for rating, sign in changes)
+    star_deltas = Counter()
+    for rating, sign in changes:
+        star_deltas[rating_bucket(rating)] += sign
+
+    new_count = F('review_count') + count_delta
+    new_total = F('rating_total') + total_delta
+    updates = {
+        'review_count': new_count,
+        'rating_total': new_total,
+        # SET expressions see the old row, so compare against the old count
+        'avg_rating': Case(
+            When(review_count__gt=-count_delta, then=new_total / new_count),
+            default=Value(0.0),
+            output_field=FloatField(),
+        ),
+    }
+    for star, delta in star_deltas.items():
+        if delta:
+            field = f'rating_{star}_count'
+            updates[field] = F(field) + delta
+
+    Product.objects.filter(pk=product_id).update(**updates)
+
+
+@receiver(pre_save, sender=ReviewRating)
+def remember_previous_rating(sender, instance, **kwargs):
+    instance._previous_rating = None
+    if instance.pk:
+        instance._previous_rating = ReviewRating.objects.filter(pk=instance.pk).values(
+            'product_id', 'rating', 'status'
+        ).first()
+
+
+@receiver(post_save, sender=ReviewRating)
+def update_rating_summary(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_rating', None)
+    if previous and (previous['product_id'], previous['rating'], previous['status']) == (
+        instance.product_id, instance.rating, instance.status
+    ):
+        return
+
+    changes = {}
+    if previous and previous['status']:
+        changes.setdefault(previous['product_id'], []).append((previous['rating'], -1))
+    if instance.status:
+        changes.setdefault(instance.product_id, []).append((instance.rating, 1))
+    for product_id, product_changes in changes.items():
+        apply_rating_changes(product_id, product_changes)
+    refresh_product_facets(changes)
+
+
+@receiver(post_delete, sender=ReviewRating)
+def remove_from_rating_summary(sender, instance, origin=None, **kwargs):
+    # Nothing to keep in sync when the reviews go because the product is deleted
+    if getattr(origin, 'model', type(origin)) is Product:
+        return
+    if instance.status:
+        apply_rating_changes(instance.product_id, [(instance.rating, -1)])
+        refresh_product_facets([instance.product_id])
+
+
+@receiver(m2m_changed, sender=Product.category.through)
+def sync_primary_category(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # pk_set is None on clear, so remember which products lose this category
+        instance._cleared_product_ids = list(instance.products.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        product_ids = [instance.pk]
+    elif action == 'post_clear':
+        product_ids = getattr(instance, '_cleared_product_ids', [])
+    else:
+        product_ids = pk_set
+    Product.objects.refresh_primary_category(product_ids)
+    refresh_product_facets(product_ids)
+    invalidate_categories()
+
+
+@receiver(pre_save, sender=Category)
+def remember_previous_category(sender, instance, **kwargs):
+    instance._previous_category = None
+    if instance.pk:
+        instance._previous_category = Category.objects.filter(pk=instance.pk).values(
+            'slug', 'category_name'
+        ).first()
+
+
+@receiver(post_save, sender=Category)
+def resync_category_products(sender, instance, created, raw=False, **kwargs):
+    previous = getattr(instance, '_previous_category', None)
+    if raw or created or not previous:
+        return
+    # A new slug changes URLs, a new name can change which category comes first
+    if (previous['slug'], previous['category_name']) != (instance.slug, instance.category_name):
+        product_ids = list(instance.products.values_list('pk', flat=True))
+        Product.objects.refresh_primary_category(product_ids)
+        refresh_product_facets(product_ids)
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_products(sender, instance, **kwargs):
+    # The memberships are cascaded away without an m2m_changed signal
+    instance._member_product_ids = list(instance.products.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def resync_orphaned_products(sender, instance, **kwargs):
+    Product.objects.refresh_primary_category(
+        Product.objects.filter(primary_category_slug=instance.slug).values_list('pk', flat=True)
+    )
+    refresh_product_facets(getattr(instance, '_member_product_ids', []))
+
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    # Stock and other bookkeeping saves don't touch the indexed text
+    if update_fields is not None and not set(update_fields) & set(INDEXED_FIELDS):
+        return
+    index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, **kwargs):
+    remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def update_product_facets(sender, instance, raw=False, **kwargs):
+    if not raw:
+        refresh_product_facets([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def update_category_counts(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Category product counts only depend on membership and availability
+    if raw or (update_fields is not None and 'is_available' not in update_fields):
+        return
+    invalidate_categories()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def update_category_list(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_categories()
+
+
+@receiver(post_save, sender=Variation)
+@receiver(post_delete, sender=Variation)
+def update_variation_facets(sender, instance, raw=False, origin=None, **kwargs):
+    if raw or getattr(origin, 'model', type(origin)) is Product:
+        return
+    refresh_product_facets([instance.product_id])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_pages(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    tags = [LISTINGS_TAG, product_tag(instance.pk)]
+    # Availability changes the category counts in the navigation on every page
+    if update_fields is None or 'is_available' in update_fields:
+        tags.append(NAV_TAG)
+    invalidate_tags(*tags)
+
+
+@receiver(post_save, sender=Variation)
+@receiver(post_delete, sender=Variation)
+@receiver(post_save, sender=ProductGallery)
+@receiver(post_delete, sender=ProductGallery)
+@receiver(post_save, sender=ReviewRating)
+@receiver(post_delete, sender=ReviewRating)
+def invalidate_product_detail_pages(sender, instance, raw=False, origin=None, **kwargs):
+    if raw or getattr(origin, 'model', type(origin)) is Product:
+        return
+    tags = [product_tag(instance.product_id)]
+    # Gallery images only show on the product page, ratings and variations
+    # also feed the listing cards and facets
+    if sender is not ProductGallery:
+        tags.append(LISTINGS_TAG)
+    invalidate_tags(*tags)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(m2m_changed, sender=Product.category.through)
+def invalidate_category_pages(sender, instance, raw=False, action=None, **kwargs):
+    if raw or (action is not None and action not in ('post_add', 'post_remove', 'post_clear')):
+        return
+    # The category navigation is on every page, so this drops all of them
+    invalidate_tags(NAV_TAG, LISTINGS_TAG)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductGallery)
+@receiver(post_save, sender=Category)
+def build_image_variants(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    field_name = {Product: 'product_image', ProductGallery: 'images', Category: 'category_image'}[sender]
+    # Only new or replaced uploads, the variants record which file they were built from
+    if needs_variants(instance, field_name):
+        transaction.on_commit(lambda: generate_image_variants(instance, field_name))
@@ -0,0 +1,67 @@
+from django import template
+from django.utils.html import format_html
+
+register = template.Library()
+
+
+def _sizes(instance, field_name):
+    return (getattr(instance, f'{field_name}_variants', None) or {}).get('sizes', [])
+
+
+def _srcset(instance, field_name, image_format):
+    field_file = getattr(instance, field_name)
+    entries = [
+        f'{field_file.storage.url(size[image_format])} {size["width"]}w'
+        for size in _sizes(instance, field_name)
+    ]
+    width = getattr(instance, f'{field_name}_width', None)
+    if entries and width:
+        # The original is the largest candidate in either list
+        entries.append(f'{field_file.url} {width}w')
+    return ', '.join(entries)
+
+
+@register.simple_tag
+def image_srcset(instance, field_name, image_format='jpeg'):
+    """srcset value for an image field, e.g. {% image_srcset product 'product_image' 'webp' %}."""
+    if not getattr(instance, field_name):
+        return ''
+    return _srcset(instance, field_name, image_format)
+
+
+@register.simple_tag
+def image_url(instance, field_name, width):
+    """URL of the smallest JPEG variant at least width pixels wide, or of the original."""
+    field_file = getattr(instance, field_name)
+    if not field_file:
+        return ''
+    for size in _sizes(instance, field_name):
+        if size['width'] >= int(width):
+            return field_file.storage.url(size['jpeg'])
+    return field_file.url
+
+
+@register.simple_tag
+def responsive_image(instance, field_name, sizes='100vw', alt='', css_class='', loading='lazy'):
+    """
+    <picture> with WebP and JPEG srcsets and the original's width/height,
+    falling back to a plain <img> for images without variants.
+    """
+    field_file = getattr(instance, field_name)
+    if not field_file:
+        return ''
+    width = getattr(instance, f'{field_name}_width', None)
+    height = getattr(instance, f'{field_name}_height', None)
+    dimensions = format_html(' width="{}" height="{}"', width, height) if width and height else ''
+    if not _sizes(instance, field_name):
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" loading="{}"{}>',
+            field_file.url, alt, css_class, loading, dimensions,
+        )
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="{}" decoding="async"{}></picture>',
+        _srcset(instance, field_name, 'webp'), sizes,
+        image_url(instance, field_name, 640), _srcset(instance, field_name, 'jpeg'), sizes,
+        alt, css_class, loading, dimensions,
+    )
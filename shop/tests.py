@@ -1,3 +1,351 @@
-from django.test import TestCase
+import importlib
+import os
+import tempfile
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.db.models import F
+from django.http import HttpResponse
+from django.template import engines
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from PIL import Image
+
+from accounts.models import Account
+from carts.models import Cart, CartItem
+from shop import context_processors
+from shop.facets import FacetIndex, refresh_product_facets
+from shop.management.commands.import_catalog import Command
+from shop.models import Category, Product, ProductFacet, ReviewRating
+from shop.page_cache import CART_COUNT_PLACEHOLDER, CSRF_PLACEHOLDER, cache_anonymous_page
+from shop.pagination import SORT_KEYS, paginate_products
+from shop.search import get_backend, search_products
+from utils.testing import use_temporary_media
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(category_name='Sports', slug='sports')
+        self.product = Product.objects.create(
+            product_name='Badminton Racket', slug='badminton-racket', price=30, stock=5
+        )
+        self.product.category.add(self.category)
+
+    def assertFilledIn(self, response):
+        self.assertNotIn(CSRF_PLACEHOLDER.encode(), response.content)
+        self.assertNotIn(CART_COUNT_PLACEHOLDER.encode(), response.content)
+
+    def test_product_page_with_admin_in_its_path(self):
+        url = '/store/sports/badminton-racket/'
+        first = self.client.get(url)
+        second = self.client.get(url)
+        self.assertEqual((first.status_code, second.status_code), (200, 200))
+        self.assertEqual((first['X-Page-Cache'], second['X-Page-Cache']), ('miss', 'hit'))
+        self.assertFilledIn(first)
+        self.assertFilledIn(second)
+
+    def test_cart_badge_is_per_visitor(self):
+        self.client.get('/store/')
+        session = self.client.session
+        session.save()
+        self.client.cookies['sessionid'] = session.session_key
+        cart = Cart.objects.create(cart_id=session.session_key)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=3)
+
+        response = self.client.get('/store/')
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertFilledIn(response)
+        self.assertIn(b'>3<', response.content)
+
+    def test_uncached_responses_are_filled_in_too(self):
+        template = engines['django'].from_string('{{ csrf_token }}|{{ cart_count }}')
+
+        @cache_anonymous_page()
+        def not_found(request):
+            return HttpResponse(template.render(request=request), status=404)
+
+        request = RequestFactory().get('/store/missing/')
+        request.user = AnonymousUser()
+        SessionMiddleware(lambda request: None).process_request(request)
+        response = not_found(request)
+        self.assertEqual(response.status_code, 404)
+        self.assertFilledIn(response)
+        self.assertTrue(response.content.endswith(b'|0'))
+
+
+class ImportCatalogTests(TestCase):
+    def run_import(self, content, suffix='.csv'):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, encoding='utf-8') as feed:
+            feed.write(content)
+            feed.flush()
+            stdout, stderr = StringIO(), StringIO()
+            call_command('import_catalog', feed.name, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_existing_category_is_matched_by_name(self):
+        tshirts = Category.objects.create(category_name='T-Shirts', slug='tshirts')
+        stdout, _ = self.run_import(
+            'slug,product_name,price,stock,categories\n'
+            'plain-tee,Plain Tee,12,4,T-Shirts|Summer\n'
+        )
+        product = Product.objects.get(slug='plain-tee')
+        self.assertEqual(
+            sorted(product.category.values_list('slug', flat=True)), ['summer', tshirts.slug]
+        )
+        self.assertEqual(Category.objects.count(), 2)
+        self.assertIn('categories created: 1', stdout)
+
+    def test_bad_rows_are_rejected_one_by_one(self):
+        stdout, stderr = self.run_import(
+            'slug,product_name,price,stock\n'
+            'good-one,Good One,10,1\n'
+            'bad-price,Bad Price,ten,1\n'
+            'good-two,Good Two,5,2\n'
+        )
+        self.assertEqual(
+            sorted(Product.objects.values_list('slug', flat=True)), ['good-one', 'good-two']
+        )
+        self.assertIn('Line 3: price', stderr)
+        self.assertIn('rejected: 1', stdout)
+
+    def test_rows_the_database_refuses_are_rejected_one_by_one(self):
+        sync_gallery = Command.sync_gallery
+
+        def refuse_bad_rows(command, records, products):
+            if any(record['slug'] == 'bad-row' for record in records):
+                raise IntegrityError('value too long for type character varying(200)')
+            sync_gallery(command, records, products)
+
+        with mock.patch.object(Command, 'sync_gallery', refuse_bad_rows):
+            stdout, stderr = self.run_import(
+                'slug,product_name,price,stock,categories\n'
+                'good-one,Good One,10,1,Rackets\n'
+                'bad-row,Bad Row,10,1,Balls\n'
+                'good-two,Good Two,5,2,Rackets\n'
+            )
+        self.assertEqual(
+            sorted(Product.objects.values_list('slug', flat=True)), ['good-one', 'good-two']
+        )
+        self.assertEqual(list(Category.objects.values_list('slug', flat=True)), ['rackets'])
+        self.assertIn('Line 3: value too long', stderr)
+        self.assertIn('products created: 2', stdout)
+        self.assertIn('categories created: 1', stdout)
+        self.assertIn('rejected: 1', stdout)
+
+    def test_bad_json_lines_are_rejected_one_by_one(self):
+        stdout, stderr = self.run_import(
+            '{"slug": "good", "price": 3, "stock": 1}\n'
+            '{"slug": "broken", \n'
+            '["not", "an", "object"]\n',
+            suffix='.jsonl',
+        )
+        self.assertEqual(list(Product.objects.values_list('slug', flat=True)), ['good'])
+        self.assertIn('Line 2:', stderr)
+        self.assertIn('Line 3: not an object', stderr)
+        self.assertIn('rejected: 2', stdout)
+
+
+class FacetIndexTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(category_name='Sports', slug='sports')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = Product.objects.create(
+                product_name='Badminton Racket', slug='badminton-racket', price=30, stock=5
+            )
+            self.product.category.add(self.category)
+
+    def test_other_processes_catch_up_on_changes(self):
+        # A second index stands in for another worker process
+        index = FacetIndex().sync()
+        self.assertIn(self.product.pk, index.values[('price', '0-50')])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = 75
+            self.product.save()
+        index.sync()
+        self.assertNotIn(self.product.pk, index.values[('price', '0-50')])
+        self.assertIn(self.product.pk, index.values[('price', '50-100')])
+
+    def test_migration_backfills_existing_products(self):
+        expected = set(ProductFacet.objects.values_list('product_id', 'facet', 'value', 'label'))
+        ProductFacet.objects.all().delete()
+        migration = importlib.import_module('shop.migrations.0016_productfacet')
+        migration.backfill_facets(apps, None)
+        self.assertEqual(set(ProductFacet.objects.values_list('product_id', 'facet', 'value', 'label')), expected)
+        self.assertIn((self.product.pk, 'category', 'sports', 'Sports'), expected)
+
+
+class SearchIndexTests(TestCase):
+    def test_migration_backfills_existing_products(self):
+        product = Product.objects.create(
+            product_name='Badminton Racket', slug='badminton-racket', price=30, stock=5,
+            product_content='<p>Carbon &amp; graphite frame</p>',
+        )
+        Product.objects.create(
+            product_name='Retired Racket', slug='retired-racket', price=30, stock=5, is_available=False
+        )
+        get_backend().clear()
+        self.assertEqual(list(search_products('racket')), [])
+
+        migration = importlib.import_module('shop.migrations.0014_product_search_index')
+        migration.backfill_search_index(apps, SimpleNamespace(connection=connection))
+        self.assertEqual(list(search_products('racket')), [product])
+        self.assertEqual(list(search_products('graphite')), [product])
+
+
+class RatingSummaryTests(TestCase):
+    def test_rebuild_refreshes_facets_and_ignores_rounding(self):
+        product = Product.objects.create(product_name='Racket', slug='racket', price=30, stock=5)
+        user = Account.objects.create(first_name='A', last_name='B', username='ab', email='ab@example.com')
+        for rating in (0.1, 0.2, 4.7):
+            ReviewRating.objects.create(product=product, user=user, rating=rating)
+        Product.objects.update(review_count=0, rating_total=0, avg_rating=0)
+        refresh_product_facets([product.pk])
+
+        stdout = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebuild_rating_summary', stdout=stdout)
+        self.assertIn('repaired 1 rating summaries', stdout.getvalue())
+        self.assertTrue(ProductFacet.objects.filter(product=product, facet='rating', value='1').exists())
+
+        # Rounding noise, e.g. from summing in another order, is not drift
+        Product.objects.update(rating_total=F('rating_total') + 1e-12, avg_rating=F('avg_rating') - 1e-12)
+        stdout = StringIO()
+        call_command('rebuild_rating_summary', stdout=stdout)
+        self.assertIn('repaired 0 rating summaries', stdout.getvalue())
+
+    def test_migration_backfills_existing_reviews(self):
+        product = Product.objects.create(product_name='Racket', slug='racket', price=30, stock=5)
+        user = Account.objects.create(first_name='A', last_name='B', username='ab', email='ab@example.com')
+        for rating, status in ((5, True), (4.5, True), (2, True), (1, False)):
+            ReviewRating.objects.create(product=product, user=user, rating=rating, status=status)
+        Product.objects.update(
+            review_count=0, rating_total=0, avg_rating=0,
+            **{f'rating_{star}_count': 0 for star in range(1, 6)},
+        )
+
+        migration = importlib.import_module('shop.migrations.0012_product_rating_summary')
+        migration.backfill_rating_summary(apps, None)
+        product.refresh_from_db()
+        self.assertEqual((product.review_count, product.rating_total, product.avg_rating), (3, 11.5, 11.5 / 3))
+        self.assertEqual(
+            [getattr(product, f'rating_{star}_count') for star in range(1, 6)], [0, 1, 0, 1, 1]
+        )
+
+
+class BuildImageVariantsTests(TransactionTestCase):
+    def test_every_failing_file_is_reported(self):
+        media = use_temporary_media(self, 'huge.jpg')
+        with open(os.path.join(media, 'broken.jpg'), 'wb') as file:
+            file.write(b'not an image')
+        # bulk_create skips the signal that would build the variants right away
+        Product.objects.bulk_create([
+            Product(product_name='Huge', slug='huge', price=1, stock=1, product_image='huge.jpg'),
+            Product(product_name='Broken', slug='broken', price=1, stock=1, product_image='broken.jpg'),
+        ])
+
+        stdout, stderr = StringIO(), StringIO()
+        # Worker processes are forked, so they see the lowered pixel limit too
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 100):
+            call_command('build_image_variants', workers=1, stdout=stdout, stderr=stderr)
+        self.assertIn('DecompressionBombError', stderr.getvalue())
+        self.assertIn('UnidentifiedImageError', stderr.getvalue())
+        self.assertIn('(2 failed)', stdout.getvalue())
+
+
+class KeysetPaginationTests(TestCase):
+    per_page = 3
+
+    def setUp(self):
+        # Runs of equal prices and names, so pages split inside ties
+        for number, price in enumerate([5, 5, 5, 10, 10, 20, 20, 20]):
+            Product.objects.create(
+                product_name=f'Racket {number % 2}', slug=f'racket-{number}', price=price, stock=1
+            )
+
+    def page(self, sort, **params):
+        request = RequestFactory().get('/store/', params)
+        page, _, _ = paginate_products(request, Product.objects.all(), self.per_page, sort, count=0)
+        return page
+
+    def test_next_and_previous_round_trip(self):
+        for sort in SORT_KEYS:
+            with self.subTest(sort=sort):
+                expected = list(Product.objects.order_by(*SORT_KEYS[sort]))
+                pages = [self.page(sort)]
+                while pages[-1].has_next():
+                    pages.append(self.page(sort, after=pages[-1].next_token))
+                self.assertEqual([product for page in pages for product in page], expected)
+                self.assertEqual([page.number for page in pages], [1, 2, 3])
+                self.assertFalse(pages[0].has_previous())
+
+                # Walking back from the last page shows the same pages
+                page = pages[-1]
+                for previous in reversed(pages[:-1]):
+                    page = self.page(sort, before=page.previous_token)
+                    self.assertEqual((page.number, list(page)), (previous.number, list(previous)))
+                self.assertFalse(page.has_previous())
+
+    def test_tampered_or_foreign_tokens_start_over(self):
+        first = self.page('price_low')
+        token = first.next_token
+        for bad in (token[:-1] + ('A' if token[-1] != 'A' else 'B'), 'garbage', token.replace(':', '', 1)):
+            page = self.page('price_low', after=bad)
+            self.assertEqual((page.number, list(page)), (1, list(first)))
+        # A token is only valid for the sort it was made for
+        page = self.page('price_high', after=token)
+        self.assertEqual((page.number, list(page)), (1, list(self.page('price_high'))))
+
+
+class CategoryListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        context_processors._local = (None, None, 0, 0)
+        self.addCleanup(setattr, context_processors, '_local', (None, None, 0, 0))
+
+    def test_local_copy_is_trusted_between_rechecks(self):
+        Category.objects.create(category_name='Sports', slug='sports')
+        self.assertEqual([c.slug for c in context_processors.get_category_list()], ['sports'])
+        with self.assertNumQueries(0), mock.patch.object(context_processors.cache, 'get') as cache_get:
+            context_processors.get_category_list()
+        cache_get.assert_not_called()
+
+    def test_changes_in_this_process_show_right_away(self):
+        context_processors.get_category_list()
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(category_name='Sports', slug='sports')
+        self.assertEqual([c.slug for c in context_processors.get_category_list()], ['sports'])
+
+
+class ImageVariantUsageTests(TestCase):
+    def setUp(self):
+        use_temporary_media(self, 'shirt.jpg', 'sports.jpg', size=(400, 300))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(
+                category_name='Sports', slug='sports', category_image='sports.jpg'
+            )
+            self.product = Product.objects.create(
+                product_name='Shirt', slug='shirt', price=10, stock=5, product_image='shirt.jpg'
+            )
+        self.product.refresh_from_db()
+
+    def test_admin_previews_use_the_small_variant(self):
+        admin = Account.objects.create_superuser(
+            first_name='A', last_name='B', username='admin', email='admin@example.com', password='secret'
+        )
+        self.client.force_login(admin)
+        response = self.client.get(f'/admin/shop/product/{self.product.pk}/change/')
+        self.assertEqual(response.status_code, 200)
+        [variant] = [size['jpeg'] for size in self.product.product_image_variants['sizes'] if size['width'] == 160]
+        self.assertContains(response, f'<img src="/media/{variant}" width="80"')
+
+    def test_store_shows_category_variants(self):
+        response = self.client.get('/store/')
+        self.assertContains(response, 'sports-160.webp 160w')
@@ -1,21 +1,21 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import redirect, render, get_object_or_404
 from carts.models import CartItem
 from carts.views import _cart_id
+from shop import feeds
+from shop.facets import filter_products, get_facet_index, selected_facets
 from shop.forms import ReviewForm
 from shop.models import Category, Product, ProductGallery, ReviewRating
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
-from django.db.models import Q
-from django.db.models import Avg, Count
+from shop.page_cache import LISTINGS_TAG, add_page_cache_tags, cache_anonymous_page, product_tag
+from shop.pagination import SORT_CHOICES, get_sort, paginate_products
+from shop.search import search_products
 from django.contrib import messages
 
+@cache_anonymous_page(LISTINGS_TAG)
 def home(request):
-    products = Product.objects.all().filter(is_available=True)
-    
-    # Add rating data to each product
-    for product in products:
-        reviews = ReviewRating.objects.filter(product=product, status=True)
-        product.review_count = reviews.count()
-        product.avg_rating = reviews.aggregate(Avg('rating'))['rating__avg'] or 0
+    # Ratings come from the product summary, URLs are resolved in one query
+    products = Product.objects.resolve_urls(Product.objects.filter(is_available=True))
     
     context = {
         'products': products,
@@ -23,47 +23,64 @@ def home(request):
     return render(request, 'shop/home.html', context)
 
 
+@cache_anonymous_page(LISTINGS_TAG)
 def store(request):
-    products = Product.objects.all().filter(is_available=True)
-    
-    # Add rating data to each product
-    for product in products:
-        reviews = ReviewRating.objects.filter(product=product, status=True)
-        product.review_count = reviews.count()
-        product.avg_rating = reviews.aggregate(Avg('rating'))['rating__avg'] or 0
+    # Facet filters go through the facet table, counts come from the in-memory facet index
+    selected = selected_facets(request)
+    facet_index = get_facet_index()
+    products = filter_products(Product.objects.filter(is_available=True), selected)
+    sort = get_sort(request)
     
-    paginator = Paginator(products, 6)
-    page = request.GET.get('page')
-    paged_product = paginator.get_page(page)
-    product_count = products.count()
+    paged_product, product_count, product_count_is_estimate = paginate_products(
+        request, products, 6, sort, count=facet_index.count(selected)
+    )
+    paged_product.object_list = Product.objects.resolve_urls(paged_product.object_list)
 
     context = {
         'products': products,
         'paged_product': paged_product,
         'product_count': product_count,
+        'product_count_is_estimate': product_count_is_estimate,
+        'sort': sort,
+        'sort_choices': SORT_CHOICES,
+        'facets': facet_index.counts(selected),
     }
     return render(request, 'shop/store.html', context)
 
+@cache_anonymous_page(LISTINGS_TAG)
 def products_by_category(request, category_slug):
     category = get_object_or_404(Category, slug=category_slug)
-    products = Product.objects.filter(category=category, is_available=True)
-    paginator = Paginator(products, 2)
-    page = request.GET.get('page')
-    paged_product = paginator.get_page(page)
+    selected = selected_facets(request, category=category.slug)
+    facet_index = get_facet_index()
+    products = filter_products(
+        Product.objects.filter(category=category, is_available=True),
+        {facet: values for facet, values in selected.items() if facet != 'category'},
+    )
+    sort = get_sort(request)
+    paged_product, product_count, product_count_is_estimate = paginate_products(
+        request, products, 2, sort, count=facet_index.count(selected)
+    )
+    paged_product.object_list = Product.objects.resolve_urls(paged_product.object_list)
     context = {
         'category': category,
         'products': products,
         'paged_product': paged_product,
-        'product_count': products.count(),
+        'product_count': product_count,
+        'product_count_is_estimate': product_count_is_estimate,
+        'sort': sort,
+        'sort_choices': SORT_CHOICES,
+        'facets': facet_index.counts(selected),
     }
     return render(request, 'shop/store.html', context)
 
+@cache_anonymous_page()
 def product_detail(request, category_slug, product_slug):
     """
     Display product details with ratings and reviews.
     Handles review submission for authenticated users.
     """
     product = get_object_or_404(Product, slug=product_slug, category__slug=category_slug)
+    add_page_cache_tags(request, product_tag(product.pk))
 
     # Get the product gallery
     product_gallery = ProductGallery.objects.filter(product=product)
@@ -99,23 +116,11 @@ def product_detail(request, category_slug, product_slug):
     else:
         form = ReviewForm()
     
-    # Get reviews and calculate statistics
+    # Get reviews, statistics come from the product's rating summary
     reviews = ReviewRating.objects.filter(product=product, status=True).order_by('-created_at')
-    review_count = reviews.count()
-    
-    # Calculate average rating and rating distribution
-    if review_count > 0:
-        avg_rating = reviews.aggregate(Avg('rating'))['rating__avg']
-        rating_distribution = {
-            5: reviews.filter(rating=5).count(),
-            4: reviews.filter(rating=4).count(),
-            3: reviews.filter(rating=3).count(),
-            2: reviews.filter(rating=2).count(),
-            1: reviews.filter(rating=1).count(),
-        }
-    else:
-        avg_rating = 0
-        rating_distribution = {5: 0, 4: 0, 3: 0, 2: 0, 1: 0}
+    review_count = product.review_count
+    avg_rating = product.avg_rating
+    rating_distribution = product.rating_distribution()
     
     # Check if user has purchased this product
     user_has_purchased = False
@@ -144,24 +149,31 @@ def product_detail(request, category_slug, product_slug):
     return render(request, 'shop/product_detail.html', context)
 
 def product_search(request):
-    if 'search-query' in request.GET:
-        search_query = request.GET['search-query']
-        if search_query:
-            products = Product.objects.filter(
-                Q(product_name__icontains=search_query) | 
-                Q(short_description__icontains=search_query) |
-                Q(product_content__icontains=search_query),
-                is_available=True
-            ).order_by('-created_date')
+    search_query = request.GET.get('search-query', '').strip()
+    # Ranked results straight from the full-text index, empty query finds nothing
+    products = search_products(search_query)
     
-    paginator = Paginator(products, 6)
-    page = request.GET.get('page')
-    paged_product = paginator.get_page(page)
+    paged_product, product_count, product_count_is_estimate = paginate_products(request, products, 6)
+    paged_product.object_list = Product.objects.resolve_urls(paged_product.object_list)
     
     context = {
         'products': products,
         'paged_product': paged_product,
-        'product_count': products.count(),
+        'product_count': product_count,
+        'product_count_is_estimate': product_count_is_estimate,
         'search_query': search_query,
     }
-    return render(request, 'shop/store.html', context)
\ No newline at end of file
+    return render(request, 'shop/store.html', context)
+
+
+@staff_member_required
+def product_feed(request, feed_format):
+    # Streamed as it is generated, memory stays flat whatever the catalog size
+    if feed_format not in feeds.FEED_FORMATS:
+        raise Http404
+    response = StreamingHttpResponse(
+        feeds.product_feed(feed_format, request.build_absolute_uri('/')),
+        content_type=feeds.FEED_FORMATS[feed_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="products.{feed_format}"'
+    return response
@@ -1,3 +1,9 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db import connection
+from django.db.models import Q
 from django.utils import timezone
 import pytz
 from shop.models import GmailToken
@@ -8,8 +14,84 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from django.conf import settings
 
 
+logger = logging.getLogger(__name__)
 
+# Refresh this long before the access token expires, while the old one still works.
+# google-auth itself stops treating a token as valid about 4 minutes before expiry.
+REFRESH_AHEAD = timedelta(minutes=10)
+# Wait between two background refresh attempts after a failure
+REFRESH_RETRY = 30
+# How long a worker's claim to refresh the token lasts, covers Google's slowest answer
+REFRESH_CLAIM_TIMEOUT = timedelta(minutes=3)
+# How long other workers wait for that refresh when they have no valid token, and how often they look
+REFRESH_WAIT = 30
+REFRESH_POLL = 0.25
 
+# Process-wide credentials shared by every GmailAPIBackend instance
+_cached_credentials = None
+_cache_lock = threading.Lock()
+_refresh_thread = None
+_refresh_started = None
+_refresh_lock = threading.Lock()
+
+
+def _expires_soon(creds):
+    # google-auth keeps expiry as a naive UTC datetime
+    now = datetime.now(dt_timezone.utc).replace(tzinfo=None)
+    return creds.expiry is not None and creds.expiry - REFRESH_AHEAD <= now
+
+
+def get_cached_credentials():
+    """
+    Valid credentials, read from the database only when the cached ones are
+    missing or expired. Shortly before expiry the cached token keeps being
+    handed out while one background thread refreshes it. Safe to call from
+    several threads at once.
+    """
+    global _cached_credentials
+    creds = _cached_credentials
+    if creds is None or not creds.valid:
+        # Threads arriving meanwhile wait here for this result
+        with _cache_lock:
+            if _cached_credentials is None or not _cached_credentials.valid:
+                _cached_credentials = GmailCredentialsManager().get_fresh_credentials()
+            creds = _cached_credentials
+    if _expires_soon(creds):
+        _start_background_refresh()
+    return creds
+
+
+def _start_background_refresh():
+    global _refresh_thread, _refresh_started
+    with _refresh_lock:
+        if _refresh_thread is not None and _refresh_thread.is_alive():
+            return
+        if _refresh_started is not None and time.monotonic() - _refresh_started < REFRESH_RETRY:
+            return
+        _refresh_started = time.monotonic()
+        _refresh_thread = threading.Thread(target=_refresh_in_background, name='gmail-token-refresh', daemon=True)
+        _refresh_thread.start()
+
+
+def _refresh_in_background():
+    global _cached_credentials
+    try:
+        creds = GmailCredentialsManager().get_fresh_credentials(refresh_ahead=True)
+        with _cache_lock:
+            _cached_credentials = creds
+    except Exception as e:
+        logger.warning(f"Background Gmail token refresh failed: {e}")
+    finally:
+        connection.close()
+
+
+def clear_cached_credentials():
+    """Forgets the cached credentials so the next call reads the database again."""
+    global _cached_credentials, _refresh_started
+    with _cache_lock:
+        _cached_credentials = None
+    with _refresh_lock:
+        _refresh_started = None
 
 
 class GmailCredentialsManager:
@@ -24,84 +106,131 @@ class GmailCredentialsManager:
         self.client_secret_path = settings.GMAIL_CLIENT_SECRET_PATH
     
     def get_credentials(self):
-        """Get valid Gmail API credentials"""
-        creds = self._load_credentials()
-        
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                if self._refresh_credentials(creds):
+        """Get valid Gmail API credentials, from the process-wide cache"""
+        return get_cached_credentials()
+
+    def get_fresh_credentials(self, refresh_ahead=False):
+        """
+        Credentials from the database, refreshed first when they are no longer
+        valid (or, with refresh_ahead, expire soon). The worker that claims the
+        token row asks Google, outside any transaction; the others keep using
+        the current token while it is valid, or wait for the new one.
+        """
+        token_obj = GmailToken.objects.order_by('pk').first()
+        creds = self._credentials_from_token(token_obj) if token_obj else None
+        if creds and creds.valid and not (refresh_ahead and _expires_soon(creds)):
+            return creds
+
+        if creds and creds.refresh_token:
+            claim = self._claim_refresh(token_obj)
+            if claim is not None:
+                if self._refresh_credentials(creds, token_obj, claim):
                     return creds
-            
-            # If refresh fails or no refresh token, need new authorization
-            raise Exception(
-                "Gmail credentials are invalid or expired. "
-                "Please run: python manage.py generate_gmail_token"
-            )
-        
-        return creds
-    
-    def _load_credentials(self):
-        """Load credentials from database"""
-        try:
-            token_obj = GmailToken.objects.first()
-            if not token_obj:
-                return None
-                
-            # Convert expiry to UTC naive datetime (what Google expects)
-            expiry = None
-            if token_obj.token_expiry:
-                if token_obj.token_expiry.tzinfo is not None:
-                    # Convert timezone-aware to UTC naive
-                    expiry = token_obj.token_expiry.astimezone(pytz.UTC).replace(tzinfo=None)
-                else:
-                    expiry = token_obj.token_expiry
-                    
-            creds = Credentials(
-                token=token_obj.access_token,
-                refresh_token=token_obj.refresh_token,
-                token_uri="https://oauth2.googleapis.com/token",
-                client_id=settings.GMAIL_CLIENT_ID,
-                client_secret=settings.GMAIL_CLIENT_SECRET,
-                expiry=expiry  # UTC naive datetime
-            )
+            elif not creds.valid:
+                creds = self._wait_for_refresh(token_obj) or creds
+
+        # The refresh failed or is someone else's, the current token is still good for a while
+        if creds and creds.valid:
             return creds
-        except Exception as e:
-            print(f"Error loading credentials: {e}")
-            return None
-    
-    def _refresh_credentials(self, creds):
-        """Refresh expired credentials"""
+
+        # If refresh fails or no refresh token, need new authorization
+        raise Exception(
+            "Gmail credentials are invalid or expired. "
+            "Please run: python manage.py generate_gmail_token"
+        )
+
+    def _claim_refresh(self, token_obj):
+        """
+        Marks the token row as being refreshed by us, with one short UPDATE.
+        Returns the claim, None when another worker holds one or already
+        stored a newer token.
+        """
+        now = timezone.now()
+        claim = now + REFRESH_CLAIM_TIMEOUT
+        claimed = GmailToken.objects.filter(
+            Q(refresh_claimed_until__isnull=True) | Q(refresh_claimed_until__lt=now),
+            pk=token_obj.pk,
+            token_expiry=token_obj.token_expiry,
+        ).update(refresh_claimed_until=claim)
+        return claim if claimed else None
+
+    def _wait_for_refresh(self, token_obj):
+        """Polls until the worker holding the claim stores a new token, None on timeout."""
+        deadline = time.monotonic() + REFRESH_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(REFRESH_POLL)
+            current = GmailToken.objects.filter(pk=token_obj.pk).first()
+            if current is None:
+                return None
+            if current.token_expiry != token_obj.token_expiry:
+                return self._credentials_from_token(current)
+            if current.refresh_claimed_until is None or current.refresh_claimed_until < timezone.now():
+                # The refresh was abandoned, nothing new is coming
+                return None
+        return None
+
+    def _credentials_from_token(self, token_obj):
+        """Build credentials from a GmailToken row"""
+        # Convert expiry to UTC naive datetime (what Google expects)
+        expiry = None
+        if token_obj.token_expiry:
+            if token_obj.token_expiry.tzinfo is not None:
+                # Convert timezone-aware to UTC naive
+                expiry = token_obj.token_expiry.astimezone(pytz.UTC).replace(tzinfo=None)
+            else:
+                expiry = token_obj.token_expiry
+
+        return Credentials(
+            token=token_obj.access_token,
+            refresh_token=token_obj.refresh_token,
+            token_uri="https://oauth2.googleapis.com/token",
+            client_id=settings.GMAIL_CLIENT_ID,
+            client_secret=settings.GMAIL_CLIENT_SECRET,
+            expiry=expiry  # UTC naive datetime
+        )
+
+    def _refresh_credentials(self, creds, token_obj, claim):
+        """Refresh credentials with Google, then store them if our claim still stands"""
         try:
             # Store refresh_token before refresh (Google sometimes nullifies it)
             refresh_token = creds.refresh_token
             creds.refresh(Request())
-            
+
             # Restore refresh_token if it got nullified
             if not creds.refresh_token and refresh_token:
                 creds.refresh_token = refresh_token
-                
-            self._save_credentials(creds)
-            return True
         except Exception as e:
-            print(f"Token refresh failed: {e}")
+            logger.warning(f"Token refresh failed: {e}")
+            GmailToken.objects.filter(pk=token_obj.pk, refresh_claimed_until=claim).update(
+                refresh_claimed_until=None
+            )
             return False
-    
+
+        GmailToken.objects.filter(pk=token_obj.pk, refresh_claimed_until=claim).update(
+            access_token=creds.token,
+            refresh_token=creds.refresh_token,
+            token_expiry=self._aware_expiry(creds),
+            refresh_claimed_until=None,
+            updated_at=timezone.now(),
+        )
+        return True
+
+    def _aware_expiry(self, creds):
+        """Expiry as timezone-aware UTC, the way it's stored"""
+        if not creds.expiry:
+            return None
+        if creds.expiry.tzinfo is None:
+            # Assume UTC if naive
+            return timezone.make_aware(creds.expiry, pytz.UTC)
+        return creds.expiry.astimezone(pytz.UTC)
+
     def _save_credentials(self, creds):
         """Save credentials to database"""
-        # Store expiry as timezone-aware UTC
-        token_expiry = None
-        if creds.expiry:
-            if creds.expiry.tzinfo is None:
-                # Assume UTC if naive
-                token_expiry = timezone.make_aware(creds.expiry, pytz.UTC)
-            else:
-                token_expiry = creds.expiry.astimezone(pytz.UTC)
-        
         GmailToken.objects.update_or_create(
             defaults={
                 'access_token': creds.token,
                 'refresh_token': creds.refresh_token,
-                'token_expiry': token_expiry
+                'token_expiry': self._aware_expiry(creds)
             }
         )
     
@@ -1,71 +1,134 @@
 import base64
 import logging
-from googleapiclient.discovery import build
+import threading
+
+import google_auth_httplib2
+import httplib2
+from django.conf import settings
 from django.core.mail.backends.base import BaseEmailBackend
-from .generate_credentials import GmailCredentialsManager
+from django.utils.module_loading import import_string
+from googleapiclient.discovery import build
+
+from .generate_credentials import get_cached_credentials
 
 logger = logging.getLogger(__name__)
 
+# Gmail accepts up to 100 calls per batch but starts rate limiting above 50
+BATCH_SIZE = 50
+
+# The discovery document ships with google-api-python-client, so building the
+# service costs no HTTP request. It is built once per process and shared;
+# httplib2 isn't thread-safe though, so every thread sends with its own Http.
+_service = None
+_service_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_service():
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                # Requests are always executed with the calling thread's authorized Http
+                _service = build(
+                    'gmail', 'v1', http=httplib2.Http(), static_discovery=True, cache_discovery=False
+                )
+    return _service
+
+
+def _transport():
+    """The underlying HTTP object, GMAIL_HTTP_TRANSPORT swaps in a fake for offline use."""
+    transport = getattr(settings, 'GMAIL_HTTP_TRANSPORT', None)
+    return import_string(transport)() if transport else httplib2.Http()
+
+
+def get_http():
+    """This thread's authorized Http, rebuilt when the shared credentials are replaced."""
+    creds = get_cached_credentials()
+    if getattr(_local, 'credentials', None) is not creds:
+        _local.http = google_auth_httplib2.AuthorizedHttp(creds, http=_transport())
+        _local.credentials = creds
+    return _local.http
+
+
+class GmailSendError(Exception):
+    """Some messages of a send_messages call failed, results holds (message, message_id, error) per message."""
+
+    def __init__(self, results):
+        self.results = results
+        failed = [error for _, _, error in results if error is not None]
+        super().__init__(f"{len(failed)} of {len(results)} emails failed: {failed[0]}")
+
 
 class GmailAPIBackend(BaseEmailBackend):
-    
-    def __init__(self, fail_silently=False, **kwargs):
-        super().__init__(fail_silently=fail_silently)
-        self.credentials_manager = GmailCredentialsManager()
-        self._service = None
-    
-    @property
-    def service(self):
-        
-        if self._service is None:
-            try:
-                creds = self.credentials_manager.get_credentials()
-                self._service = build('gmail', 'v1', credentials=creds)
-            except Exception as e:
-                if not self.fail_silently:
-                    logger.error(f"Failed to initialize Gmail service: {e}")
-                raise
-        return self._service
-    
+
     def send_messages(self, email_messages):
-        """Send multiple email messages"""
+        """Send multiple email messages, in Gmail batch requests when there is more than one"""
         if not email_messages:
             return 0
-        
+
         try:
-            service = self.service
-        except Exception:
+            service = get_service()
+            http = get_http()
+        except Exception as e:
             if self.fail_silently:
                 return 0
+            logger.error(f"Failed to initialize Gmail service: {e}")
             raise
-        
-        sent_count = 0
-        for message in email_messages:
-            if self._send_single_message(service, message):
-                sent_count += 1
-        
-        return sent_count
-    
-    def _send_single_message(self, service, email_message):
-        """Send a single email message"""
+
+        results = []
+        if len(email_messages) == 1:
+            results.append(self._send_single_message(service, http, email_messages[0]))
+        else:
+            for start in range(0, len(email_messages), BATCH_SIZE):
+                results.extend(self._send_batch(service, http, email_messages[start:start + BATCH_SIZE]))
+
+        failed = [result for result in results if result[2] is not None]
+        for message, _, error in failed:
+            logger.error(f"Failed to send email to {', '.join(message.to)}: {error}")
+        if failed and not self.fail_silently:
+            raise GmailSendError(results)
+        return len(results) - len(failed)
+
+    def _send_request(self, service, email_message):
+        return service.users().messages().send(
+            userId='me',
+            body={'raw': self._create_raw_message(email_message)}
+        )
+
+    def _send_single_message(self, service, http, email_message):
+        """Send a single email message, returns (message, message_id, error)"""
         try:
-            raw_message = self._create_raw_message(email_message)
-            result = service.users().messages().send(
-                userId='me',
-                body={'raw': raw_message}
-            ).execute()
-            
-            logger.info(f"Email sent successfully. Message ID: {result['id']}")
-            return True
-            
+            result = self._send_request(service, email_message).execute(http=http)
         except Exception as e:
-            error_msg = f"Failed to send email: {e}"
-            if not self.fail_silently:
-                logger.error(error_msg)
-                raise
-            return False
-    
+            return email_message, None, e
+        logger.info(f"Email sent successfully. Message ID: {result['id']}")
+        return email_message, result['id'], None
+
+    def _send_batch(self, service, http, email_messages):
+        """Send up to BATCH_SIZE messages in one HTTP request, returns (message, message_id, error) for each"""
+        results = {}
+
+        def collect(request_id, response, exception):
+            results[request_id] = (response or {}).get('id'), exception
+
+        batch = service.new_batch_http_request(callback=collect)
+        for number, email_message in enumerate(email_messages):
+            batch.add(self._send_request(service, email_message), request_id=str(number))
+        try:
+            batch.execute(http=http)
+        except Exception as e:
+            return [(email_message, None, e) for email_message in email_messages]
+
+        sent = []
+        for number, email_message in enumerate(email_messages):
+            message_id, error = results.get(str(number), (None, Exception('No response in batch')))
+            if error is None:
+                logger.info(f"Email sent successfully. Message ID: {message_id}")
+            sent.append((email_message, message_id, error))
+        return sent
+
     def _create_raw_message(self, email_message):
         """Convert Django email message to Gmail API format"""
         mime_message = email_message.message()
-        return base64.urlsafe_b64encode(mime_message.as_bytes()).decode('utf-8')
\ No newline at end of file
+        return base64.urlsafe_b64encode(mime_message.as_bytes()).decode('utf-8')
@@ -0,0 +1,81 @@
+"""
+An offline stand-in for the Gmail API's HTTP endpoint.
+
+Point GMAIL_HTTP_TRANSPORT at 'utils.gmail_fake.FakeGmailHttp' and
+GmailAPIBackend sends through it instead of the network: single sends and
+batch requests are answered like Gmail does, with an optional delay per HTTP
+round trip (LATENCY) for benchmarks and recipients that get a 400 (FAIL_TO)
+for error handling tests. Every accepted message is kept in SENT.
+"""
+import base64
+import email
+import json
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+
+import httplib2
+
+# batchPath from the bundled discovery document, relative to gmail.googleapis.com
+BATCH_PATH = '/batch'
+
+
+class FakeGmailHttp:
+    LATENCY = 0
+    FAIL_TO = set()
+    SENT = []
+    REQUESTS = []
+    _lock = threading.Lock()
+
+    @classmethod
+    def reset(cls):
+        cls.LATENCY = 0
+        cls.FAIL_TO = set()
+        with cls._lock:
+            cls.SENT.clear()
+            cls.REQUESTS.clear()
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=None, connection_type=None):
+        with self._lock:
+            self.REQUESTS.append(uri)
+        if self.LATENCY:
+            time.sleep(self.LATENCY)
+        if urllib.parse.urlparse(uri).path == BATCH_PATH:
+            return self._batch(body, headers)
+        status, payload = self._send(body)
+        return httplib2.Response({'status': status, 'content-type': 'application/json'}), payload
+
+    def _send(self, body):
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        raw = base64.urlsafe_b64decode(json.loads(body)['raw'])
+        message = email.message_from_bytes(raw)
+        if message['To'] in self.FAIL_TO:
+            return 400, json.dumps({'error': {'code': 400, 'message': f"Invalid To header: {message['To']}"}}).encode()
+        with self._lock:
+            self.SENT.append(message)
+        return 200, json.dumps({'id': uuid.uuid4().hex[:16], 'labelIds': ['SENT']}).encode()
+
+    def _batch(self, body, headers):
+        content_type = {key.lower(): value for key, value in headers.items()}['content-type']
+        request = email.message_from_string(f'Content-Type: {content_type}\n\n{body}')
+        boundary = uuid.uuid4().hex
+        parts = []
+        for part in request.get_payload():
+            # Each part is an HTTP request: request line, headers, blank line, JSON body
+            _, inner_body = re.split(r'\r?\n\r?\n', part.get_payload(), maxsplit=1)
+            status, payload = self._send(inner_body)
+            reason = 'OK' if status == 200 else 'Bad Request'
+            parts.append(
+                f'--{boundary}\r\n'
+                f'Content-Type: application/http\r\n'
+                f'Content-ID: <response-{part["Content-ID"][1:-1]}>\r\n\r\n'
+                f'HTTP/1.1 {status} {reason}\r\n'
+                f'Content-Type: application/json\r\n\r\n'
+                f'{payload.decode()}\r\n'
+            )
+        content = ''.join(parts) + f'--{boundary}--\r\n'
+        response = httplib2.Response({'status': 200, 'content-type': f'multipart/mixed; boundary={boundary}'})
+        return response, content.encode()
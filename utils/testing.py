@@ -0,0 +1,18 @@
+"""Helpers shared by the apps' test suites."""
+import os
+import tempfile
+
+from django.test import override_settings
+from PIL import Image
+
+
+def use_temporary_media(test, *names, size=(40, 40)):
+    """Points MEDIA_ROOT at a temporary directory holding a real JPEG of size for each name."""
+    media = tempfile.TemporaryDirectory()
+    test.addCleanup(media.cleanup)
+    for name in names:
+        Image.new('RGB', size, 'red').save(os.path.join(media.name, name))
+    settings = override_settings(MEDIA_ROOT=media.name)
+    settings.enable()
+    test.addCleanup(settings.disable)
+    return media.name
@@ -0,0 +1,129 @@
+"""
+Content-addressed storage for editor uploads.
+
+Files are hashed (SHA-256) while the upload streams to a temporary file and are
+stored as <directory>/<hash[:2]>/<hash><ext>, so uploading the same file again
+finds the stored copy instead of writing a renamed duplicate. Images above
+TINYMCE_UPLOAD_MAX_DIMENSION or TINYMCE_UPLOAD_MAX_BYTES are downscaled and
+re-encoded first; JPEGs are scaled by the decoder, so even very large photos
+are never fully decoded in memory.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+CHUNK_SIZE = 64 * 1024
+# Re-encoded images stay in memory up to this size, then spill to disk
+SPOOL_SIZE = 1024 * 1024
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """Streams uploads to a temporary file and sets file.sha256 on the way."""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.digest.hexdigest()
+        return file
+
+
+def file_hash(file):
+    digest = hashlib.sha256()
+    for chunk in file.chunks(CHUNK_SIZE):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def _extension(name):
+    extension = os.path.splitext(name)[1].lower()
+    return extension if re.fullmatch(r'\.[a-z0-9]{1,10}', extension) else ''
+
+
+def _open_image(file):
+    """The upload as a lazily decoded Pillow image, or None if it isn't one."""
+    try:
+        return Image.open(file)
+    except Image.DecompressionBombError:
+        raise ImageTooLarge(file.name)
+    except (UnidentifiedImageError, OSError):
+        file.seek(0)
+        return None
+
+
+def _reencode_format(image, size):
+    """(Pillow format, extension) to re-encode an oversized image as, or None to keep it."""
+    max_dimension = getattr(settings, 'TINYMCE_UPLOAD_MAX_DIMENSION', 2048)
+    max_bytes = getattr(settings, 'TINYMCE_UPLOAD_MAX_BYTES', 2 * 1024 * 1024)
+    if getattr(image, 'n_frames', 1) > 1:
+        # Animations would lose their frames
+        return None
+    if max(image.size) <= max_dimension and size <= max_bytes:
+        return None
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    return ('PNG', '.png') if has_alpha else ('JPEG', '.jpg')
+
+
+def _reencode(image, image_format, name):
+    max_dimension = getattr(settings, 'TINYMCE_UPLOAD_MAX_DIMENSION', 2048)
+    max_pixels = getattr(settings, 'TINYMCE_UPLOAD_MAX_PIXELS', 50_000_000)
+    if image.format == 'JPEG':
+        # Decode at the smallest DCT scale that is still at least max_dimension
+        image.draft('RGB', (max_dimension, max_dimension))
+    if image.width * image.height > max_pixels:
+        raise ImageTooLarge(name)
+
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    if image_format == 'JPEG':
+        image.convert('RGB').save(output, 'JPEG', quality=85, optimize=True, progressive=True)
+    else:
+        image.save(output, 'PNG', optimize=True)
+    output.seek(0)
+    return File(output, name=name)
+
+
+def store_upload(file, directory):
+    """
+    Stores an uploaded file under its content hash and returns the storage
+    name. Nothing is written when the same upload is already stored.
+    """
+    digest = getattr(file, 'sha256', None) or file_hash(file)
+    image = _open_image(file)
+    reencode = _reencode_format(image, file.size) if image else None
+    extension = reencode[1] if reencode else _extension(file.name)
+
+    name = f'{directory}/{digest[:2]}/{digest}{extension}'
+    if default_storage.exists(name):
+        return name
+    if reencode:
+        content = _reencode(image, reencode[0], name)
+    else:
+        file.seek(0)
+        content = file
+    try:
+        return default_storage.save(name, content)
+    finally:
+        if reencode:
+            content.close()
+        if image:
+            image.close()